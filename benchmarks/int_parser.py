@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of tally-methods.
+# Copyright (C) 2024  Sequent Tech Inc <legal@sequentech.io>
+
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compares the time it takes to parse long ballots with int() and with
+parse_decimal(). Run it with:
+
+    python -m benchmarks.int_parser
+'''
+
+import random
+import sys
+import timeit
+
+from tally_methods.ballot_codec.int_parser import parse_decimal
+
+DIGIT_COUNTS = (1000, 3000, 10000, 30000, 100000)
+
+def get_digits(length, rand):
+    return str(rand.randint(1, 9)) + ''.join(
+        str(rand.randint(0, 9))
+        for _ in range(length - 1)
+    )
+
+def best_time(function, digits):
+    timer = timeit.Timer(lambda: function(digits))
+    number = max(1, timer.autorange()[0])
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+def main():
+    # disable the interpreter digit limit, so that int() can be compared
+    if hasattr(sys, 'set_int_max_str_digits'):
+        sys.set_int_max_str_digits(0)
+
+    rand = random.Random(0)
+    print("%10s %14s %20s %8s" % ("digits", "int() ms", "parse_decimal() ms", "speedup"))
+    for length in DIGIT_COUNTS:
+        digits = get_digits(length, rand)
+        assert int(digits) == parse_decimal(digits)
+        int_time = best_time(int, digits)
+        parse_time = best_time(parse_decimal, digits)
+        print("%10d %14.3f %20.3f %7.2fx" % (
+            length,
+            int_time * 1000,
+            parse_time * 1000,
+            int_time / parse_time
+        ))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# This file is part of tally-methods.
+# Copyright (C) 2024  Sequent Tech Inc <legal@sequentech.io>
+
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Measures how the tally of a large question scales with the number of threads
+that decode its ballots, compared with a sequential tally. Threads only run in
+parallel on Python builds without the global interpreter lock. Run it with:
+
+    python -m benchmarks.thread_tally [num_ballots]
+'''
+
+import copy
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from tally_methods import file_helpers
+from tally_methods.ballot_codec.sequent_codec import NVotesCodec
+from tally_methods.parallel import do_chunkedtally, is_gil_enabled
+from tally_methods.tally import do_tally
+
+THREAD_COUNTS = (1, 2, 4, 8, 16)
+NUM_BALLOTS = 100000
+NUM_ANSWERS = 30
+MAX_SELECTED = 5
+
+def get_question():
+    return dict(
+        tally_type='plurality-at-large',
+        title='Benchmark question',
+        description='',
+        layout='',
+        min=0,
+        max=MAX_SELECTED,
+        num_winners=MAX_SELECTED,
+        randomize_answer_order=False,
+        answer_total_votes_percentage='over-total-votes',
+        extra_options=dict(),
+        answers=[
+            dict(
+                id=answer_id,
+                text='Candidate %d' % answer_id,
+                category='',
+                details='',
+                urls=[]
+            )
+            for answer_id in range(NUM_ANSWERS)
+        ]
+    )
+
+def get_plaintext(question, rand):
+    ballot_question = copy.deepcopy(question)
+    selected = rand.sample(
+        range(NUM_ANSWERS),
+        rand.randint(0, MAX_SELECTED)
+    )
+    for answer in ballot_question['answers']:
+        answer['selected'] = 0 if answer['id'] in selected else -1
+    codec = NVotesCodec(ballot_question)
+    return codec.encode_to_int(codec.encode_raw_ballot()) + 1
+
+def write_tally_dir(dir_path, question, num_ballots):
+    rand = random.Random(0)
+    file_helpers.write_file(
+        os.path.join(dir_path, 'questions_json'),
+        json.dumps([question])
+    )
+    question_path = os.path.join(dir_path, '0-question')
+    os.mkdir(question_path)
+    with open(
+        os.path.join(question_path, 'plaintexts_json'),
+        mode='w'
+    ) as plaintexts_file:
+        for _ in range(num_ballots):
+            plaintexts_file.write('"%d"\n' % get_plaintext(question, rand))
+
+def best_time(function, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = function()
+        times.append(time.perf_counter() - start)
+    return min(times), results
+
+def main():
+    num_ballots = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_BALLOTS
+    question = get_question()
+    dir_path = tempfile.mkdtemp()
+    try:
+        write_tally_dir(dir_path, question, num_ballots)
+        sequential_time, should_results = best_time(
+            lambda: do_tally(dir_path, [question], ignore_invalid_votes=True)
+        )
+        print("%d ballots, %d CPUs, GIL %s" % (
+            num_ballots,
+            os.cpu_count() or 1,
+            "enabled" if is_gil_enabled() else "disabled"
+        ))
+        print("%8s %10s %8s" % ("threads", "time s", "speedup"))
+        print("%8s %10.3f %7.2fx" % ("seq", sequential_time, 1.0))
+        for threads in THREAD_COUNTS:
+            thread_time, results = best_time(
+                lambda: do_chunkedtally(
+                    dir_path,
+                    [question],
+                    ignore_invalid_votes=True,
+                    workers=threads,
+                    min_chunk_size=1,
+                    use_threads=True
+                )
+            )
+            assert results == should_results
+            print("%8d %10.3f %7.2fx" % (
+                threads,
+                thread_time,
+                sequential_time / thread_time
+            ))
+    finally:
+        file_helpers.remove_tree(dir_path)
+
+if __name__ == "__main__":
+    main()
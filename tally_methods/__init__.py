@@ -0,0 +1 @@
+__version__ = '4.0.0'
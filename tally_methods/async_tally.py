@@ -0,0 +1,140 @@
+# This file is part of tally-methods.
+# Copyright (C) 2024  Sequent Tech Inc <legal@sequentech.io>
+
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Tallying of ballots read from asyncio streams, as they become available.
+
+The streams carry plaintexts_json lines. They are read on the event loop in
+chunks, and each chunk of complete lines is decoded and added to the tally in
+an executor, so that the event loop stays responsive while tallying.
+'''
+
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from tally_methods.plaintexts import READ_BUFFER_SIZE
+from tally_methods.tally import TallyEngine
+
+async def _read_question_stream(engine, question_index, reader, executor):
+    '''
+    Reads a stream until it is closed, adding the ballots of each chunk of
+    complete lines to the tally of the given question. Returns the number of
+    ballots read.
+    '''
+    loop = asyncio.get_running_loop()
+    count = 0
+    pending = b''
+    while True:
+        data = await reader.read(engine.read_buffer_size)
+        if len(data) == 0:
+            break
+
+        data = pending + data
+        end = data.rfind(b'\n') + 1
+        pending = data[end:]
+        if end > 0:
+            count += await loop.run_in_executor(
+                executor,
+                engine.add_ballots,
+                question_index,
+                io.BytesIO(data[:end])
+            )
+
+    # the last line might not end with a newline
+    if len(pending) > 0:
+        count += await loop.run_in_executor(
+            executor,
+            engine.add_ballots,
+            question_index,
+            [pending]
+        )
+    return count
+
+async def tally_stream(
+    questions,
+    readers,
+    tallies=None,
+    ignore_invalid_votes=False,
+    encrypted_invalid_votes=0,
+    monkey_patcher=None,
+    question_indexes=None,
+    withdrawals=None,
+    allow_empty_tally=False,
+    read_buffer_size=READ_BUFFER_SIZE,
+    executor=None,
+    invalid_vote_sink=None
+):
+    '''
+    Tallies an election from the plaintexts_json lines read from the given
+    asyncio.StreamReader objects and returns the results once all of them are
+    closed. readers is a dict whose keys are the question indexes and whose
+    values are the readers, or a single reader for the first question.
+
+    Ballots are decoded in the given executor. By default a single worker
+    thread is used, which serializes the updates of the tally objects and the
+    calls to the invalid_vote_sink, if given.
+    '''
+    if isinstance(readers, asyncio.StreamReader):
+        readers = {0: readers}
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=1)
+
+    loop = asyncio.get_running_loop()
+    try:
+        with TallyEngine(
+            ignore_invalid_votes=ignore_invalid_votes,
+            monkey_patcher=monkey_patcher,
+            allow_empty_tally=allow_empty_tally,
+            read_buffer_size=read_buffer_size,
+            invalid_vote_sink=invalid_vote_sink
+        ) as engine:
+            engine.start(
+                questions=questions,
+                encrypted_invalid_votes=encrypted_invalid_votes,
+                question_indexes=question_indexes,
+                withdrawals=withdrawals
+            )
+
+            question_readers = []
+            for qindex in range(len(engine.questions)):
+                if not engine.is_tallied(qindex):
+                    continue
+
+                if qindex not in readers:
+                    if not allow_empty_tally:
+                        raise KeyError(
+                            "no ballot stream given for question %d" % qindex
+                        )
+                    continue
+                question_readers.append(_read_question_stream(
+                    engine,
+                    qindex,
+                    readers[qindex],
+                    executor
+                ))
+
+            await asyncio.gather(*question_readers)
+
+            # post_tally runs once all the streams are closed
+            results = await loop.run_in_executor(executor, engine.finish)
+            if tallies is not None:
+                tallies.extend(engine.tallies)
+            return results
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)
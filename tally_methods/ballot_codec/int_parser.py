@@ -0,0 +1,183 @@
+# This file is part of tally-methods.
+#
+# Copyright (C) 2024 Sequent Tech Inc <legal@sequentech.io>
+#
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+#
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import sys
+import threading
+import unittest
+
+'''
+This module implements the parsing and formatting of very long decimal
+numbers, like the ones of ballots with long write-ins.
+
+Python's int() takes quadratic time to parse a decimal string, and newer
+interpreters refuse strings longer than sys.get_int_max_str_digits(). Here
+the string is split in two halves which are parsed recursively and then
+combined with a single multiplication, so that parsing costs about as much as
+multiplying two numbers of that size. Within the recursion, int() is only used
+for chunks of up to CHUNK_DIGITS digits, which is below the minimum value
+allowed for the interpreter digit limit, so the limit never applies.
+format_decimal() does the opposite, splitting the number with the same powers
+of ten.
+'''
+
+# maximum number of digits parsed directly with int() in the recursion
+CHUNK_DIGITS = 512
+
+# int() is faster than the recursion for numbers of up to this many digits,
+# so it is used for them when the interpreter digit limit allows it
+DIRECT_DIGITS = 4000
+
+# _powers[k] is 10**(CHUNK_DIGITS * 2**k). It is only extended while holding
+# _powers_lock, as ballots can be parsed by several threads at once
+_powers = [10 ** CHUNK_DIGITS]
+_powers_lock = threading.Lock()
+
+def _get_power(k):
+  if k < len(_powers):
+    return _powers[k]
+  with _powers_lock:
+    while len(_powers) <= k:
+      _powers.append(_powers[-1] * _powers[-1])
+  return _powers[k]
+
+def _parse(digits, start, end):
+  length = end - start
+  if length <= CHUNK_DIGITS:
+    return int(digits[start:end])
+
+  # the low part has CHUNK_DIGITS * 2**k digits, with the largest k that
+  # leaves some digits for the high part, so that the same powers of ten are
+  # reused for all the numbers
+  k = 0
+  while CHUNK_DIGITS * 2**(k + 1) < length:
+    k += 1
+  low_length = CHUNK_DIGITS * 2**k
+  high = _parse(digits, start, end - low_length)
+  low = _parse(digits, end - low_length, end)
+  return high * _get_power(k) + low
+
+def _get_max_direct_digits():
+  if not hasattr(sys, 'get_int_max_str_digits'):
+    return DIRECT_DIGITS
+  max_str_digits = sys.get_int_max_str_digits()
+  if max_str_digits == 0:
+    return DIRECT_DIGITS
+  return min(DIRECT_DIGITS, max_str_digits)
+
+def parse_decimal(digits):
+  '''
+  Parses a str or bytes with a non-negative decimal number, optionally
+  surrounded by whitespace, and returns it as an int. Raises ValueError if it
+  is not a valid number.
+  '''
+  if len(digits) <= CHUNK_DIGITS:
+    return int(digits)
+
+  digits = digits.strip()
+  if len(digits) == 0 or not digits.isascii() or not digits.isdigit():
+    raise ValueError("invalid decimal number of %d characters" % len(digits))
+  if len(digits) <= _get_max_direct_digits():
+    return int(digits)
+  return _parse(digits, 0, len(digits))
+
+def _format(value):
+  if value < _powers[0]:
+    return str(value)
+
+  # value < _get_power(k + 1) == _get_power(k)**2, so both halves are smaller
+  # than _get_power(k)
+  k = 0
+  while _get_power(k + 1) <= value:
+    k += 1
+  high, low = divmod(value, _get_power(k))
+  return _format(high) + _format(low).zfill(CHUNK_DIGITS * 2**k)
+
+def format_decimal(value):
+  '''
+  Returns the decimal str of an int, which unlike str() works for ints with
+  more digits than sys.get_int_max_str_digits()
+  '''
+  if value < 0:
+    return '-' + _format(-value)
+  return _format(value)
+
+
+class TestIntParser(unittest.TestCase):
+  '''
+  Unit tests related to the parse_decimal function
+  '''
+  def _naive_parse(self, digits):
+    value = 0
+    for index in range(0, len(digits), 100):
+      chunk = digits[index:index + 100]
+      value = value * 10**len(chunk) + int(chunk)
+    return value
+
+  def test_parse(self):
+    rand = random.Random(0)
+    for length in [1, 511, 512, 513, 1024, 1025, 4000, 4001, 5000, 20000]:
+      digits = str(rand.randint(1, 9)) + ''.join(
+        str(rand.randint(0, 9))
+        for _ in range(length - 1)
+      )
+      value = self._naive_parse(digits)
+      self.assertEqual(parse_decimal(digits), value)
+      self.assertEqual(parse_decimal(digits.encode('ascii')), value)
+
+  def test_format(self):
+    rand = random.Random(0)
+    for length in [1, 511, 512, 513, 1024, 1025, 4000, 4301, 5000, 20000]:
+      digits = str(rand.randint(1, 9)) + ''.join(
+        str(rand.randint(0, 9))
+        for _ in range(length - 1)
+      )
+      value = self._naive_parse(digits)
+      self.assertEqual(format_decimal(value), digits)
+      self.assertEqual(format_decimal(-value), '-' + digits)
+    self.assertEqual(format_decimal(0), '0')
+    self.assertEqual(format_decimal(10**1024), '1' + '0' * 1024)
+
+  def test_leading_zeros_and_whitespace(self):
+    digits = '0' * 3000 + '1' + '0' * 1000
+    self.assertEqual(parse_decimal(' ' + digits + '\n'), 10**1000)
+
+  def test_invalid(self):
+    for digits in ['1' * 2000 + 'a', '-' + '1' * 2000, ' ' * 2000, 'abc']:
+      self.assertRaises(ValueError, parse_decimal, digits)
+
+  def test_threads(self):
+    # the powers of ten are computed by several threads at once, which must
+    # not append the same power twice
+    global _powers
+    saved_powers = _powers
+    _powers = [10 ** CHUNK_DIGITS]
+    try:
+      barrier = threading.Barrier(8)
+      def get_powers():
+        barrier.wait()
+        for k in range(6):
+          _get_power(k)
+      threads = [threading.Thread(target=get_powers) for _ in range(8)]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+      self.assertEqual(
+        _powers,
+        [10 ** (CHUNK_DIGITS << k) for k in range(6)]
+      )
+    finally:
+      _powers = saved_powers
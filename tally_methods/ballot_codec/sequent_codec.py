@@ -13,8 +13,6 @@
 # along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
-import copy
-from operator import itemgetter
 
 from tally_methods.ballot_codec import mixed_radix
 from ..file_helpers import serialize
@@ -42,22 +40,47 @@ class NVotesCodec(object):
   question = None
 
   def __init__(self, question):
-    self.question = copy.deepcopy(question)
+    # the question is only read, so instead of a deep copy only the question
+    # and answer dicts are copied, which keeps the codec isolated from later
+    # changes to them
+    self.question = dict(question)
+    self.question["answers"] = [dict(answer) for answer in question["answers"]]
+    self._index_answers()
 
-  def get_bases(self):
+  def _index_answers(self):
     '''
-    Returns the bases related to this question.
+    Precomputes the positions in self.question["answers"] of the answers
+    sorted by id and segmented, which are used on every call
     '''
-    # sort answers by id
-    sorted_answers = copy.deepcopy(self.question["answers"])
-    sorted_answers.sort(key=itemgetter('id'))
-
-    valid_answers = [
-      answer 
-      for answer in sorted_answers
-      if dict(title='invalidVoteFlag', url='true') not in answer.get('urls', [])
+    answers = self.question["answers"]
+    self.sorted_indexes = sorted(
+      range(len(answers)),
+      key=lambda index: answers[index]['id']
+    )
+    self.valid_indexes = [
+      index
+      for index in self.sorted_indexes
+      if dict(title='invalidVoteFlag', url='true') not in answers[index].get('urls', [])
+    ]
+    self.invalid_indexes = [
+      index
+      for index in self.sorted_indexes
+      if dict(title='invalidVoteFlag', url='true') in answers[index].get('urls', [])
+    ]
+    self.write_in_indexes = [
+      index
+      for index in self.sorted_indexes
+      if dict(title='isWriteIn', url='true') in answers[index].get('urls', [])
     ]
+    self.allow_writeins = (
+      "extra_options" in self.question and
+      "allow_writeins" in self.question["extra_options"] and
+      self.question["extra_options"]["allow_writeins"] is True
+    )
+    # calculated on the first call to get_bases()
+    self.bases = None
 
+  def _calculate_bases(self):
     tally_type = self.question["tally_type"]
     # Calculate the base for answers. It depends on the 
     # `question.tally_type`:
@@ -77,23 +100,23 @@ class NVotesCodec(object):
 
     # Set the initial bases and raw ballot, populate bases using the valid 
     # answers list
-    bases = [2] + len(valid_answers)*[answer_base]
+    bases = [2] + len(self.valid_indexes)*[answer_base]
 
     # populate with byte-sized bases for the \0 end for each write-in
-    if (
-      "extra_options" in self.question and 
-      "allow_writeins" in self.question["extra_options"] and
-      self.question["extra_options"]["allow_writeins"] is True
-    ):
-      write_in_anwsers = [
-        answer 
-        for answer in sorted_answers
-        if dict(title='isWriteIn', url='true') in answer.get('urls', [])
-      ]
-      bases = bases + len(write_in_anwsers)*[256]
+    if self.allow_writeins:
+      bases = bases + len(self.write_in_indexes)*[256]
 
     return bases
 
+  def get_bases(self):
+    '''
+    Returns the bases related to this question.
+    '''
+    if self.bases is None:
+      self.bases = self._calculate_bases()
+    # the caller might append more bases, so a copy is returned
+    return self.bases[:]
+
   def encode_to_int(self, raw_ballot):
     '''
     Converts a raw ballot into an encoded number ready to be encrypted. 
@@ -282,11 +305,7 @@ class NVotesCodec(object):
     )
 
     # minor changes are required for the write-ins
-    if (
-      "extra_options" in self.question and
-      "allow_writeins" in self.question["extra_options"] and
-      self.question["extra_options"]["allow_writeins"] is True
-    ):
+    if self.allow_writeins:
       # make the number of bases equal to the number of choices
       index = len(bases) + 1
       while index <= len(choices):
@@ -295,11 +314,7 @@ class NVotesCodec(object):
       
       # ensure that for each write-in answer there is a \0 char at the
       # end
-      num_write_in_answers = len([
-        answer 
-        for answer in self.question["answers"]
-        if dict(title='isWriteIn', url='true') in answer.get('urls', [])
-      ])
+      num_write_in_answers = len(self.write_in_indexes)
 
       num_write_in_strings = 0
       write_ins_text_start_index = len_bases - num_write_in_answers
@@ -336,19 +351,12 @@ class NVotesCodec(object):
     Please read the description of the encode function for details on
     the output format of the raw ballot.
     '''
-    # sort answers by id
-    sorted_answers = copy.deepcopy(self.question["answers"])
-    sorted_answers.sort(key=itemgetter('id'))
-
-    # Separate the answers between:
+    # Separate the answers sorted by id between:
     # - Invalid vote answer (if any)
     # - Write-ins (if any)
     # - Valid answers (normal answers + write-ins if any)
-    invalid_answers = [
-      answer 
-      for answer in sorted_answers
-      if dict(title='invalidVoteFlag', url='true') in answer.get('urls', [])
-    ]
+    answers = self.question["answers"]
+    invalid_answers = [answers[index] for index in self.invalid_indexes]
     invalid_vote_answer = (
       None
       if len(invalid_answers) == 0
@@ -364,17 +372,8 @@ class NVotesCodec(object):
       else 0
     )
 
-    write_in_anwsers = [
-      answer 
-      for answer in sorted_answers
-      if dict(title='isWriteIn', url='true') in answer.get('urls', [])
-    ]
-
-    valid_answers = [
-      answer 
-      for answer in sorted_answers
-      if dict(title='invalidVoteFlag', url='true') not in answer.get('urls', [])
-    ]
+    write_in_anwsers = [answers[index] for index in self.write_in_indexes]
+    valid_answers = [answers[index] for index in self.valid_indexes]
 
     # Set the initial bases and raw ballot. We will populate the rest next
     bases = self.get_bases()
@@ -414,11 +413,7 @@ class NVotesCodec(object):
     # encode the write-in answer.text string with UTF-8 and use for 
     # each byte a specific value with base 256 and end each write-in 
     # with a \0 byte. Note that even write-ins.
-    if (
-      "extra_options" in self.question and
-      "allow_writeins" in self.question["extra_options"] and
-      self.question["extra_options"]["allow_writeins"] is True
-    ):
+    if self.allow_writeins:
       for answer in write_in_anwsers:
         if "text" not in answer or len(answer["text"]) == 0:
           # we don't do a bases.append(256) as this is done in get_bases()
@@ -446,27 +441,19 @@ class NVotesCodec(object):
     
     Returns `self.questions` with the data from the raw ballot.
     '''
-    # 1. clone the question and reset the selections
-    question = copy.deepcopy(self.question)
-    for answer in question['answers']:
-      answer['selected'] = -1
+    # 1. clone the question and reset the selections. Only the answer dicts
+    # are modified, so they are the only ones copied
+    answers = [
+      dict(answer, selected=-1)
+      for answer in self.question['answers']
+    ]
+    question = dict(self.question, answers=answers)
 
-    # 2. sort & segment answers
-    # 2.1. sort answers by id
-    sorted_answers = question["answers"][:]
-    sorted_answers.sort(key=itemgetter('id'))
+    # 2. segment the answers, sorted by id, with the precomputed indexes
 
     # 3. Obtain the invalidVote flag and set it
-    valid_answers = [
-      answer 
-      for answer in sorted_answers
-      if dict(title='invalidVoteFlag', url='true') not in answer.get('urls', [])
-    ]
-    invalid_answers = [
-      answer 
-      for answer in sorted_answers
-      if dict(title='invalidVoteFlag', url='true') in answer.get('urls', [])
-    ]
+    valid_answers = [answers[index] for index in self.valid_indexes]
+    invalid_answers = [answers[index] for index in self.invalid_indexes]
     invalid_vote_answer = (
       None 
       if len(invalid_answers) == 0
@@ -496,16 +483,8 @@ class NVotesCodec(object):
     # 6. Filter for the write ins, decode the write-in texts into 
     #    UTF-8 and split by the \0 character, finally the text for the
     #    write-ins.
-    if (
-      "extra_options" in question and 
-      "allow_writeins" in question["extra_options"] and
-      question["extra_options"]["allow_writeins"] is True
-    ):
-      write_in_answers = [
-        answer 
-        for answer in sorted_answers
-        if dict(title='isWriteIn', url='true') in answer.get('urls', [])
-      ]
+    if self.allow_writeins:
+      write_in_answers = [answers[index] for index in self.write_in_indexes]
       # if no write ins, return
       if len(write_in_answers) == 0:
         return question
@@ -0,0 +1,200 @@
+# This file is part of tally-methods.
+# Copyright (C) 2024  Sequent Tech Inc <legal@sequentech.io>
+
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Binary ballot files, a compact alternative to plaintexts_json.
+
+The file starts with a header made of the MAGIC bytes, the format version
+(one byte) and the question id (a varint with its length followed by its
+UTF-8 bytes). Then comes one record per ballot, made of a varint length L
+followed by the plaintext as a little-endian unsigned integer of L - 1 bytes.
+A record with L = 0 has no data and represents a ballot that could not be
+parsed, which is tallied as a null vote.
+
+Varints are unsigned LEB128 integers: 7 bits per byte, least significant
+first, with the high bit set in all the bytes but the last one.
+'''
+
+import mmap
+import os
+
+from tally_methods.plaintexts import (
+    READ_BUFFER_SIZE,
+    open_plaintexts,
+    parse_plaintexts_line
+)
+
+MAGIC = b'TMBALLOT'
+VERSION = 1
+
+INVALID_RECORD = b'\0'
+
+def encode_varint(value):
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value == 0:
+            encoded.append(byte)
+            return bytes(encoded)
+        encoded.append(byte | 0x80)
+
+def decode_varint(data, position):
+    '''
+    Decodes the varint at the given position of data. Returns a pair with its
+    value and the position after it, or None if data ends before the varint.
+    '''
+    value = 0
+    shift = 0
+    while position < len(data):
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (value, position)
+        shift += 7
+    return None
+
+def encode_record(plaintext):
+    '''
+    Returns the record of the given plaintext int, or the invalid record if
+    it is None
+    '''
+    if plaintext is None:
+        return INVALID_RECORD
+    data = plaintext.to_bytes((plaintext.bit_length() + 7) // 8, 'little')
+    return encode_varint(len(data) + 1) + data
+
+def write_header(ballot_file, question_id):
+    encoded_question_id = question_id.encode('utf-8')
+    ballot_file.write(
+        MAGIC +
+        bytes([VERSION]) +
+        encode_varint(len(encoded_question_id)) +
+        encoded_question_id
+    )
+
+def convert_plaintexts(
+    src_path,
+    dst_path,
+    question_id=None,
+    read_buffer_size=READ_BUFFER_SIZE
+):
+    '''
+    Converts a plaintexts_json file (which can be compressed) into a binary
+    ballot file. The question id defaults to the name of the directory of the
+    source file. Returns the number of ballots converted.
+    '''
+    if question_id is None:
+        question_id = os.path.basename(os.path.dirname(src_path))
+
+    count = 0
+    with open_plaintexts(src_path, read_buffer_size) as plaintexts_file, \
+        open(dst_path, mode='wb', buffering=read_buffer_size) as ballot_file:
+        write_header(ballot_file, question_id)
+        for line in plaintexts_file:
+            try:
+                record = encode_record(parse_plaintexts_line(line))
+            except (ValueError, OverflowError):
+                # lines that are not valid plaintexts, including negative
+                # numbers, are stored as invalid records
+                record = INVALID_RECORD
+            ballot_file.write(record)
+            count += 1
+    return count
+
+class BallotFileReader(object):
+    '''
+    Reads a binary ballot file through a read-only memory map. Iterating it
+    yields the plaintext int of each ballot, or None for the ballots that could
+    not be parsed and for a truncated last record. The bytes of each record
+    are copied out of the map before decoding them, which is cheaper than
+    slicing a memoryview for records of a few bytes. Iteration continues from
+    the position after the last yielded record, which can be changed with
+    seek().
+    '''
+    def __init__(self, path):
+        with open(path, mode='rb') as raw_file:
+            self.mmap = mmap.mmap(raw_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header_size = len(MAGIC) + 1
+        if (
+            len(self.mmap) < header_size or
+            self.mmap[:len(MAGIC)] != MAGIC
+        ):
+            self.close()
+            raise ValueError("%s is not a binary ballot file" % path)
+        if self.mmap[len(MAGIC)] != VERSION:
+            version = self.mmap[len(MAGIC)]
+            self.close()
+            raise ValueError("unsupported ballot file version %d" % version)
+
+        decoded = decode_varint(self.mmap, header_size)
+        if decoded is None:
+            self.close()
+            raise ValueError("truncated ballot file header in %s" % path)
+        length, position = decoded
+        self.question_id = self.mmap[position:position + length].decode('utf-8')
+        self.data_start = position + length
+        self.position = self.data_start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.mmap.close()
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position):
+        self.position = max(position, self.data_start)
+
+    def __iter__(self):
+        # the mmap is indexed directly instead of through a memoryview, so
+        # that no buffer is exported while the generator is suspended and the
+        # reader can always be closed
+        data = self.mmap
+        end = len(data)
+        while self.position < end:
+            decoded = decode_varint(data, self.position)
+            if decoded is None:
+                self.position = end
+                yield None
+                return
+            length, position = decoded
+            if length == 0:
+                self.position = position
+                yield None
+                continue
+            next_position = position + length - 1
+            if next_position > end:
+                self.position = end
+                yield None
+                return
+            self.position = next_position
+            yield int.from_bytes(data[position:next_position], 'little')
+
+def parse_ballot(plaintext):
+    '''
+    Used as the parse_ballot function of TallyEngine.add_ballots() for the
+    plaintexts read from binary ballot files
+    '''
+    if plaintext is None:
+        raise ValueError("invalid ballot record")
+    return plaintext
@@ -0,0 +1,125 @@
+# This file is part of tally-methods.
+# Copyright (C) 2024  Sequent Tech Inc <legal@sequentech.io>
+
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Checkpoint files, used to resume an interrupted tally.
+
+A checkpoint stores, for each question whose ballots have started to be read,
+the name of its ballots file, the offset up to which the file was read,
+whether it was read completely, the number of ballots read and the state of
+the question totals and of its tally object. It also stores a digest of the
+election being tallied, so that a checkpoint is never resumed with a different
+election.
+
+Checkpoint files are journals of JSON lines. The first line holds the version
+and the election digest, and each following line is the checkpoint of a
+question, which replaces any earlier line of the same question. Each save
+appends only the question being read, serialized when it is saved, so the
+questions read before are never rewritten, and a crash while writing leaves at
+most an incomplete last line, which is ignored.
+'''
+
+import hashlib
+import json
+import os
+
+CHECKPOINT_VERSION = 2
+
+# number of ballots read between checkpoints
+CHECKPOINT_INTERVAL = 100000
+
+def get_election_digest(
+    questions,
+    encrypted_invalid_votes,
+    question_indexes,
+    withdrawals
+):
+    '''
+    Returns a digest of the input of a tally, other than its ballots. The
+    question indexes can be given in any iterable, in any order.
+    '''
+    if question_indexes is not None:
+        question_indexes = sorted(question_indexes)
+    data = json.dumps(
+        [questions, encrypted_invalid_votes, question_indexes, withdrawals],
+        sort_keys=True,
+        ensure_ascii=True
+    )
+    return hashlib.sha256(data.encode('ascii')).hexdigest()
+
+def create_checkpoint(checkpoint_path, election_digest):
+    '''
+    Creates a checkpoint of the election with the given digest, with no
+    questions yet, replacing the previous one if there is one
+    '''
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, mode='w', encoding='utf-8') as checkpoint_file:
+        json.dump(
+            dict(version=CHECKPOINT_VERSION, election_digest=election_digest),
+            checkpoint_file,
+            sort_keys=True
+        )
+        checkpoint_file.write("\n")
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+def append_checkpoint(
+    checkpoint_path,
+    question_index,
+    question_checkpoint,
+    sync=True
+):
+    '''
+    Appends the checkpoint of the given question to a checkpoint created with
+    create_checkpoint(). Unless sync is False, it is flushed to disk before
+    returning.
+    '''
+    line = json.dumps(
+        dict(question_index=question_index, **question_checkpoint),
+        sort_keys=True
+    )
+    with open(checkpoint_path, mode='a', encoding='utf-8') as checkpoint_file:
+        checkpoint_file.write(line + "\n")
+        checkpoint_file.flush()
+        if sync:
+            os.fsync(checkpoint_file.fileno())
+
+def read_checkpoint(checkpoint_path, election_digest):
+    '''
+    Reads a checkpoint, checking that it belongs to the election with the
+    given digest, and returns it as a dict whose questions item maps the
+    index of each question to its last checkpoint
+    '''
+    with open(checkpoint_path, mode='r', encoding='utf-8') as checkpoint_file:
+        checkpoint = json.loads(checkpoint_file.readline())
+        if checkpoint.get('version') != CHECKPOINT_VERSION:
+            raise Exception(
+                "unsupported checkpoint version %r" % checkpoint.get('version')
+            )
+        if checkpoint['election_digest'] != election_digest:
+            raise Exception(
+                "the checkpoint %s belongs to a different election" %
+                checkpoint_path
+            )
+        checkpoint['questions'] = dict()
+        for line in checkpoint_file:
+            # the last line is incomplete if writing it was interrupted
+            if not line.endswith("\n"):
+                break
+            question_checkpoint = json.loads(line)
+            question_index = question_checkpoint.pop('question_index')
+            checkpoint['questions'][question_index] = question_checkpoint
+    return checkpoint
@@ -24,6 +24,76 @@ def serialize(data):
     return json.dumps(data,
         indent=4, ensure_ascii=False, sort_keys=True, separators=(',', ': '))
 
+# depth down to which write_json() streams the containers of its data. With the
+# results of a tally, these are the results dict, its list of questions, each
+# question, its list of answers and each answer, so that answers are encoded
+# one at a time
+STREAM_DEPTH = 4
+
+def write_json(data, out, compact=False, stream_depth=STREAM_DEPTH):
+    '''
+    Writes data as JSON to the given text file object, streaming its dicts and
+    lists so that the whole document is never built in memory. The output is
+    the same as serialize(data), or has no indentation nor spaces if compact is
+    set.
+    '''
+    if compact:
+        indent = None
+        separators = (',', ':')
+    else:
+        indent = 4
+        separators = (',', ': ')
+    encoder = json.JSONEncoder(
+        indent=indent,
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=separators
+    )
+    _write_json_value(data, out, encoder, compact, 0, stream_depth)
+
+def _write_json_value(value, out, encoder, compact, depth, stream_depth):
+    if (
+        depth >= stream_depth or
+        not isinstance(value, (dict, list, tuple)) or
+        len(value) == 0
+    ):
+        data = encoder.encode(value)
+        if not compact and depth > 0:
+            # strings are escaped so the only newlines are those of the indent
+            data = data.replace('\n', '\n' + ' ' * (4 * depth))
+        out.write(data)
+        return
+
+    if isinstance(value, dict):
+        out.write('{')
+        items = sorted(value.items())
+    else:
+        out.write('[')
+        items = value
+    if compact:
+        newline = ''
+        item_separator = ','
+        key_separator = ':'
+    else:
+        newline = '\n' + ' ' * (4 * (depth + 1))
+        item_separator = ','
+        key_separator = ': '
+
+    for index, item in enumerate(items):
+        if index > 0:
+            out.write(item_separator)
+        out.write(newline)
+        if isinstance(value, dict):
+            key, item = item
+            if not isinstance(key, str):
+                key = encoder.encode(key)
+            out.write(encoder.encode(key) + key_separator)
+        _write_json_value(item, out, encoder, compact, depth + 1, stream_depth)
+
+    if not compact:
+        out.write('\n' + ' ' * (4 * depth))
+    out.write('}' if isinstance(value, dict) else ']')
+
 def open(path, mode):
     return codecs.open(path, encoding='utf-8', mode=mode)
 
@@ -35,5 +105,9 @@ def write_file(path, data):
     with open(path, mode='w') as f:
         return f.write(data)
 
+def write_json_file(path, data, compact=False):
+    with open(path, mode='w') as f:
+        write_json(data, f, compact=compact)
+
 def remove_tree(path):
     shutil.rmtree(path)
\ No newline at end of file
@@ -0,0 +1,242 @@
+# This file is part of tally-methods.
+# Copyright (C) 2024  Sequent Tech Inc <legal@sequentech.io>
+
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Live tally of a tally directory whose plaintexts_json files are still growing.
+
+The files are tailed: each poll only reads the data appended since the
+previous one, and its complete lines are added to tally objects that persist
+for the whole tally. Snapshots of the results are taken with
+TallyEngine.snapshot(), whose cost depends on the size of the tally objects
+and not on the number of ballots read so far.
+'''
+
+import io
+import os
+import time
+
+from tally_methods.plaintexts import (
+    PLAINTEXTS_NAMES,
+    READ_BUFFER_SIZE,
+    index_tally_dir
+)
+from tally_methods.tally import TallyEngine
+
+class _FollowedFile(object):
+    '''
+    Plaintexts file being tailed, with the bytes of its last incomplete line
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, mode='rb', buffering=0)
+        self.pending = b''
+
+    def read_lines(self, size):
+        '''
+        Reads up to size new bytes and returns the complete lines read so
+        far, which might be none, or None if there is no new data
+        '''
+        data = self.file.read(size)
+        if data is None or len(data) == 0:
+            return None
+        data = self.pending + data
+        end = data.rfind(b'\n') + 1
+        self.pending = data[end:]
+        return data[:end]
+
+    def close(self):
+        self.file.close()
+
+class TallyFollower(object):
+    '''
+    Tallies a tally directory while its plaintexts_json files grow. New
+    ballots are added with poll(), and snapshot() returns the results so far.
+    The question directories are looked up on each poll, so they can be
+    created after the follower.
+    '''
+    def __init__(
+        self,
+        dir_path,
+        questions,
+        ignore_invalid_votes=False,
+        encrypted_invalid_votes=0,
+        monkey_patcher=None,
+        question_indexes=None,
+        withdrawals=None,
+        read_buffer_size=READ_BUFFER_SIZE,
+        invalid_vote_sink=None
+    ):
+        self.dir_path = dir_path
+        self.files = dict()
+        self.engine = TallyEngine(
+            ignore_invalid_votes=ignore_invalid_votes,
+            monkey_patcher=monkey_patcher,
+            read_buffer_size=read_buffer_size,
+            invalid_vote_sink=invalid_vote_sink
+        )
+        self.engine.start(
+            questions=questions,
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            question_indexes=question_indexes,
+            withdrawals=withdrawals
+        )
+        self.tallied_questions = set(
+            qindex
+            for qindex in range(len(questions))
+            if self.engine.is_tallied(qindex)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for followed_file in self.files.values():
+            followed_file.close()
+        self.files = dict()
+        self.engine.close()
+
+    def _open_new_files(self):
+        # the directory is only scanned while some tallied question has no
+        # open file
+        if len(self.files) == len(self.tallied_questions):
+            return
+
+        for qindex, (_, path) in index_tally_dir(self.dir_path).items():
+            if qindex in self.files or qindex not in self.tallied_questions:
+                continue
+            if os.path.basename(path) != PLAINTEXTS_NAMES[0]:
+                raise Exception(
+                    "only plaintexts_json files can be followed: %s" % path
+                )
+            self.files[qindex] = _FollowedFile(path)
+
+    def poll(self):
+        '''
+        Reads the data appended to each question file since the previous poll
+        and adds its complete lines to the tally. Returns the number of ballots
+        added.
+        '''
+        self._open_new_files()
+        count = 0
+        for qindex, followed_file in sorted(self.files.items()):
+            while True:
+                lines = followed_file.read_lines(self.engine.read_buffer_size)
+                if lines is None:
+                    break
+                if len(lines) > 0:
+                    count += self.engine.add_ballots(qindex, io.BytesIO(lines))
+        return count
+
+    def snapshot(self):
+        '''
+        Returns the results of the ballots added so far, in the same format as
+        do_tally()
+        '''
+        return self.engine.snapshot()
+
+    def finish(self):
+        '''
+        Adds all the remaining ballots, including incomplete last lines, and
+        returns the final results
+        '''
+        self.poll()
+        for qindex, followed_file in sorted(self.files.items()):
+            if len(followed_file.pending) > 0:
+                self.engine.add_ballots(qindex, [followed_file.pending])
+                followed_file.pending = b''
+        return self.engine.finish()
+
+    def follow(
+        self,
+        on_snapshot,
+        stop,
+        snapshot_ballots=None,
+        snapshot_interval=None,
+        poll_interval=1.0
+    ):
+        '''
+        Polls the question files until stop() returns True, for example the
+        is_set method of a threading.Event, and then returns the final results.
+
+        on_snapshot is called with a snapshot of the results every
+        snapshot_ballots new ballots and every snapshot_interval seconds, as
+        long as there are new ballots since the previous snapshot.
+        '''
+        new_ballots = 0
+        last_snapshot_time = time.monotonic()
+        while not stop():
+            count = self.poll()
+            new_ballots += count
+
+            if new_ballots > 0 and (
+                (
+                    snapshot_ballots is not None and
+                    new_ballots >= snapshot_ballots
+                ) or (
+                    snapshot_interval is not None and
+                    time.monotonic() - last_snapshot_time >= snapshot_interval
+                )
+            ):
+                on_snapshot(self.snapshot())
+                new_ballots = 0
+                last_snapshot_time = time.monotonic()
+
+            if count == 0:
+                time.sleep(poll_interval)
+
+        return self.finish()
+
+def do_followtally(
+    dir_path,
+    questions,
+    on_snapshot,
+    stop,
+    snapshot_ballots=None,
+    snapshot_interval=None,
+    poll_interval=1.0,
+    ignore_invalid_votes=False,
+    encrypted_invalid_votes=0,
+    monkey_patcher=None,
+    question_indexes=None,
+    withdrawals=None,
+    read_buffer_size=READ_BUFFER_SIZE,
+    invalid_vote_sink=None
+):
+    '''
+    Tallies the given directory while its plaintexts_json files grow, calling
+    on_snapshot with the results so far, and returns the final results once
+    stop() returns True. See TallyFollower.follow().
+    '''
+    with TallyFollower(
+        dir_path,
+        questions,
+        ignore_invalid_votes=ignore_invalid_votes,
+        encrypted_invalid_votes=encrypted_invalid_votes,
+        monkey_patcher=monkey_patcher,
+        question_indexes=question_indexes,
+        withdrawals=withdrawals,
+        read_buffer_size=read_buffer_size,
+        invalid_vote_sink=invalid_vote_sink
+    ) as follower:
+        return follower.follow(
+            on_snapshot,
+            stop,
+            snapshot_ballots=snapshot_ballots,
+            snapshot_interval=snapshot_interval,
+            poll_interval=poll_interval
+        )
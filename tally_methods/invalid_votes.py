@@ -0,0 +1,203 @@
+# This file is part of tally-methods.
+# Copyright (C) 2024  Sequent Tech Inc <legal@sequentech.io>
+
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Sinks that receive the invalid ballots found while tallying.
+
+Each invalid ballot is reported with one of these reasons:
+
+ - explicit: the voter marked the ballot as invalid.
+ - implicit: the choices of the ballot break the rules of the question, for
+   example selecting too many answers.
+ - decode: the plaintext could not be decoded into a ballot of the question.
+ - framing: the plaintext could not be read, for example because the line is
+   not a quoted decimal number.
+'''
+
+import time
+
+from tally_methods.plaintexts import plaintext_to_str
+from tally_methods.voting_systems.base import (
+    ExplicitInvalidVoteException,
+    ImplicitInvalidVoteException
+)
+
+EXPLICIT = 'explicit'
+IMPLICIT = 'implicit'
+DECODE = 'decode'
+FRAMING = 'framing'
+
+REASONS = (EXPLICIT, IMPLICIT, DECODE, FRAMING)
+
+# compact codes of the reasons, used by FileInvalidVoteSink
+REASON_CODES = dict(
+    explicit='E',
+    implicit='I',
+    decode='D',
+    framing='F'
+)
+
+# buffer size of the files written by FileInvalidVoteSink
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+def get_invalid_reason(exception, int_ballot):
+    '''
+    Returns the reason of an invalid ballot, given the exception raised while
+    parsing it and its int, which is None if the plaintext could not be read
+    '''
+    if int_ballot is None:
+        return FRAMING
+    elif isinstance(exception, ExplicitInvalidVoteException):
+        return EXPLICIT
+    elif isinstance(exception, ImplicitInvalidVoteException):
+        return IMPLICIT
+    else:
+        return DECODE
+
+class InvalidVoteSink(object):
+    '''
+    Base class of the invalid vote sinks. It counts the invalid ballots
+    received for each reason, and subclasses implement write() to do
+    something with them.
+    '''
+    def __init__(self):
+        self.counts = dict((reason, 0) for reason in REASONS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, question_index, plaintext, reason, count=1):
+        '''
+        Receives count invalid ballots of the given question with the same
+        plaintext
+        '''
+        self.counts[reason] += count
+        self.write(question_index, plaintext, reason, count)
+
+    def write(self, question_index, plaintext, reason, count):
+        pass
+
+    def get_summary(self):
+        '''
+        Returns the number of invalid ballots received for each reason
+        '''
+        return dict(self.counts)
+
+    def close(self):
+        pass
+
+class PrintInvalidVoteSink(InvalidVoteSink):
+    '''
+    Prints each invalid ballot, which is what the tally does by default
+    unless ignore_invalid_votes is set
+    '''
+    def write(self, question_index, plaintext, reason, count):
+        print("invalid vote: " + plaintext_to_str(plaintext))
+
+class RecordingInvalidVoteSink(InvalidVoteSink):
+    '''
+    Keeps the invalid ballots it receives, so that the invalid ballots found
+    in a worker process can be sent back and added to the sink of the tally
+    with replay()
+    '''
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def write(self, question_index, plaintext, reason, count):
+        self.records.append((question_index, plaintext, reason, count))
+
+def replay(records, sink):
+    '''
+    Adds to the given sink the invalid ballots kept by a
+    RecordingInvalidVoteSink
+    '''
+    for question_index, plaintext, reason, count in records:
+        sink.add(question_index, plaintext, reason, count)
+
+class FileInvalidVoteSink(InvalidVoteSink):
+    '''
+    Writes the invalid ballots to a buffered file, one per line with the
+    reason code, the question index, the number of ballots and the plaintext
+    separated by tabs.
+
+    Only one of every sample_every invalid ballots of each reason is written,
+    and at most max_per_second lines are written per second. The ballots that
+    are not written are still counted.
+    '''
+    def __init__(
+        self,
+        path,
+        sample_every=1,
+        max_per_second=None,
+        buffer_size=WRITE_BUFFER_SIZE
+    ):
+        super().__init__()
+        self.file = open(path, mode='wb', buffering=buffer_size)
+        self.sample_every = sample_every
+        self.max_per_second = max_per_second
+        self.received = dict((reason, 0) for reason in REASONS)
+        self.written = 0
+        self.dropped = 0
+        self.second = None
+        self.second_written = 0
+
+    def _is_rate_limited(self):
+        if self.max_per_second is None:
+            return False
+        second = int(time.monotonic())
+        if second != self.second:
+            self.second = second
+            self.second_written = 0
+        if self.second_written >= self.max_per_second:
+            return True
+        self.second_written += 1
+        return False
+
+    def write(self, question_index, plaintext, reason, count):
+        self.received[reason] += 1
+        if (
+            (self.received[reason] - 1) % self.sample_every != 0 or
+            self._is_rate_limited()
+        ):
+            self.dropped += count
+            return
+
+        if isinstance(plaintext, bytes):
+            plaintext = plaintext.rstrip(b'\r\n')
+        elif plaintext is None:
+            plaintext = b''
+        else:
+            plaintext = plaintext_to_str(plaintext).encode('utf-8')
+        self.file.write(
+            ("%s\t%d\t%d\t" % (REASON_CODES[reason], question_index, count))
+            .encode('ascii') +
+            plaintext +
+            b'\n'
+        )
+        self.written += count
+
+    def get_summary(self):
+        summary = super().get_summary()
+        summary['written'] = self.written
+        summary['dropped'] = self.dropped
+        return summary
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
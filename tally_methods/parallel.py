@@ -0,0 +1,640 @@
+# This file is part of tally-methods.
+# Copyright (C) 2024  Sequent Tech Inc <legal@sequentech.io>
+
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Tallies whose questions are tallied concurrently in worker processes.
+
+Each question is tallied by its own TallyEngine in a worker, which returns the
+post processed results of the question and its number of ballots. These are
+then set in the engine of the election with set_question_results(), in the
+order of the questions, so the results are the same as with a sequential
+tally.
+
+The ballots of each question are added by a job, a picklable callable that
+receives the engine of the worker and the question index, usually a
+functools.partial of one of the add_* functions of this module.
+
+Large questions can instead be split into chunks, ranges of lines of their
+plaintexts file that are tallied in different workers. The state of the tally
+of each chunk is then merged into the engine of the election with
+TallyEngine.merge_question_state() before the question is post processed.
+Chunks can also be tallied by threads, each with its own engine, which only
+runs them in parallel on Python builds without the global interpreter lock.
+
+The questions of the election are sent to each worker once, when its executor
+starts it (see create_executor()), rather than with each job, and the engine
+of each job only creates the tally object of the question it tallies.
+'''
+
+import functools
+import json
+import os
+import threading
+import zipfile
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from tally_methods.plaintexts import (
+    HISTOGRAM_FILE_NAME,
+    PLAINTEXTS_NAMES,
+    READ_BUFFER_SIZE,
+    get_question_dir_index,
+    index_tally_dir,
+    iter_histogram_lines
+)
+from tally_methods import shared_counts
+from tally_methods.invalid_votes import RecordingInvalidVoteSink, replay
+from tally_methods.tally import TallyEngine
+
+# files smaller than this are not split into more chunks
+MIN_CHUNK_SIZE = 1024 * 1024
+
+# files that can be split into chunks of lines
+CHUNKED_FILE_NAMES = (PLAINTEXTS_NAMES[0], HISTOGRAM_FILE_NAME)
+
+# the questions of the election, set in each worker by create_executor()
+_worker_state = threading.local()
+
+def is_gil_enabled():
+    '''
+    Returns True unless this is a Python build without the global interpreter
+    lock (or with it disabled), where threads decode ballots in parallel
+    '''
+    if hasattr(sys, '_is_gil_enabled'):
+        return sys._is_gil_enabled()
+    return True
+
+def _set_worker_questions(questions):
+    _worker_state.questions = questions
+
+def create_executor(executor_class, workers, questions):
+    '''
+    Returns an executor of the given class, ProcessPoolExecutor or
+    ThreadPoolExecutor, with up to the given number of workers, that can
+    tally the given questions. They are copied to each worker once when it
+    starts.
+    '''
+    return executor_class(
+        max_workers=workers,
+        initializer=_set_worker_questions,
+        initargs=(questions,)
+    )
+
+def add_question_file(path, engine, question_index):
+    '''
+    Job that adds the ballots of a question file of a tally directory, see
+    TallyEngine.add_ballots_file()
+    '''
+    return engine.add_ballots_file(question_index, path)
+
+def add_zip_member(zip_path, member_name, engine, question_index):
+    '''
+    Job that adds the ballots of a plaintexts_json member of a zip file. The
+    zip file is opened by each job, so that members can be read concurrently.
+    '''
+    with zipfile.ZipFile(zip_path) as tally_zip:
+        with tally_zip.open(member_name) as plaintexts_file:
+            return engine.add_ballots(question_index, plaintexts_file)
+
+def _get_worker_engine_args(engine, record_invalid_votes=False):
+    '''
+    Returns the arguments of the engines of the workers of the given engine.
+    Its invalid vote sink stays in this process: if it has one, or if
+    record_invalid_votes is set, the workers keep their invalid ballots,
+    which are then replayed into it.
+    '''
+    return dict(
+        monkey_patcher=engine.monkey_patcher,
+        read_buffer_size=engine.read_buffer_size,
+        record_invalid_votes=(
+            record_invalid_votes or engine.invalid_vote_sink is not None
+        )
+    )
+
+def _create_worker_engine(engine_args):
+    '''
+    Returns the engine of a worker, created with the result of
+    _get_worker_engine_args(), and its invalid vote sink
+    '''
+    engine_args = dict(engine_args)
+    invalid_vote_sink = None
+    if engine_args.pop('record_invalid_votes'):
+        invalid_vote_sink = RecordingInvalidVoteSink()
+    engine = TallyEngine(
+        ignore_invalid_votes=True,
+        invalid_vote_sink=invalid_vote_sink,
+        **engine_args
+    )
+    return (engine, invalid_vote_sink)
+
+def _get_records(invalid_vote_sink):
+    if invalid_vote_sink is None:
+        return []
+    return invalid_vote_sink.records
+
+def _tally_question(
+    question_index,
+    job,
+    engine_args,
+    encrypted_invalid_votes,
+    withdrawals
+):
+    '''
+    Tallies a single question in a worker process and returns its results,
+    its number of ballots and its invalid ballots
+    '''
+    engine, invalid_vote_sink = _create_worker_engine(engine_args)
+    with engine:
+        engine.start(
+            questions=_worker_state.questions,
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            question_indexes=[question_index],
+            withdrawals=withdrawals
+        )
+        job(engine, question_index)
+        question = engine.finish_question(question_index)
+        return (
+            question,
+            engine.question_counts[question_index],
+            _get_records(invalid_vote_sink)
+        )
+
+def tally_questions(
+    engine,
+    questions,
+    jobs,
+    workers=None,
+    sizes=None,
+    record_invalid_votes=False
+):
+    '''
+    Runs the given jobs, a dict whose keys are the question indexes, in a pool
+    of worker processes and sets their results in the given engine, which must
+    have been started with the given questions. With a single worker, the jobs
+    run in this process instead.
+
+    If sizes is given, a dict with the size of the ballots of each job, the
+    largest jobs are submitted first so that a large question does not start
+    when the rest are already done. The results are set in the order of the
+    questions anyway.
+
+    If record_invalid_votes is set, returns a dict with the invalid ballots of
+    each question, see TallyEngine.record_invalid_votes().
+    '''
+    if workers is None:
+        workers = min(os.cpu_count() or 1, max(len(jobs), 1))
+
+    invalid_votes = dict()
+    if workers <= 1:
+        for qindex in sorted(jobs):
+            if record_invalid_votes:
+                invalid_votes[qindex] = engine.record_invalid_votes(
+                    jobs[qindex],
+                    engine,
+                    qindex
+                )
+            else:
+                jobs[qindex](engine, qindex)
+            engine.finish_question(qindex)
+        return invalid_votes
+
+    engine_args = _get_worker_engine_args(engine, record_invalid_votes)
+    if sizes is None:
+        job_order = sorted(jobs)
+    else:
+        job_order = sorted(jobs, key=lambda qindex: (-sizes[qindex], qindex))
+    with create_executor(ProcessPoolExecutor, workers, questions) as executor:
+        futures = dict(
+            (
+                qindex,
+                executor.submit(
+                    _tally_question,
+                    qindex,
+                    jobs[qindex],
+                    engine_args,
+                    engine.encrypted_invalid_votes,
+                    engine.withdrawals
+                )
+            )
+            for qindex in job_order
+        )
+        for qindex in sorted(futures):
+            question, count, records = futures[qindex].result()
+            invalid_votes[qindex] = [
+                (plaintext, reason, invalid_count)
+                for _, plaintext, reason, invalid_count in records
+            ]
+            engine.set_question_results(
+                qindex,
+                question,
+                count,
+                invalid_votes[qindex]
+            )
+    return invalid_votes
+
+def tally_dir(
+    engine,
+    dir_path,
+    questions,
+    encrypted_invalid_votes=0,
+    question_indexes=None,
+    withdrawals=None,
+    dir_index=None,
+    result_cache=None,
+    workers=None
+):
+    '''
+    Tallies the election whose plaintexts are in the given directory with the
+    given engine, tallying its questions in up to the given number of worker
+    processes, by default one per CPU, and returns the results, which are the
+    same as those of TallyEngine.tally(). The largest question files are
+    tallied first.
+
+    The tally objects of the engine are not used for the questions tallied in
+    the workers. The invalid ballots found there are sent back and reported to
+    the invalid vote sink of the engine.
+    '''
+    engine.start(
+        questions=questions,
+        encrypted_invalid_votes=encrypted_invalid_votes,
+        question_indexes=question_indexes,
+        withdrawals=withdrawals
+    )
+    if dir_index is None:
+        dir_index = index_tally_dir(dir_path)
+
+    jobs = dict()
+    sizes = dict()
+    cache_keys = dict()
+    for qindex in range(len(questions)):
+        if not engine.is_tallied(qindex):
+            continue
+        if qindex not in dir_index:
+            if not engine.allow_empty_tally:
+                raise IndexError(
+                    "no plaintexts found for question %d" % qindex
+                )
+            continue
+
+        question_id, plaintexts_path = dir_index[qindex]
+        engine.tallies[qindex].question_id = question_id
+
+        if result_cache is not None:
+            cache_keys[qindex] = result_cache.get_key(
+                questions[qindex],
+                engine.get_question_withdrawals(qindex),
+                engine.encrypted_invalid_votes,
+                plaintexts_path
+            )
+            cached = result_cache.get(cache_keys[qindex])
+            if cached is not None:
+                engine.set_question_results(qindex, *cached)
+                continue
+
+        jobs[qindex] = functools.partial(add_question_file, plaintexts_path)
+        sizes[qindex] = os.path.getsize(plaintexts_path)
+
+    invalid_votes = tally_questions(
+        engine,
+        questions,
+        jobs,
+        workers,
+        sizes,
+        record_invalid_votes=result_cache is not None
+    )
+
+    if result_cache is not None:
+        for qindex in sorted(jobs):
+            result_cache.put(
+                cache_keys[qindex],
+                engine.questions[qindex],
+                engine.question_counts.get(
+                    qindex,
+                    engine.encrypted_invalid_votes
+                ),
+                invalid_votes[qindex]
+            )
+    return engine.finish()
+
+def get_file_chunks(path, num_chunks):
+    '''
+    Splits the given file into up to num_chunks ranges of whole lines of
+    about the same size, returned as a list of (start, end) byte offsets
+    '''
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    offsets = [0]
+    with open(path, mode='rb') as chunked_file:
+        for index in range(1, num_chunks):
+            chunked_file.seek(max(size * index // num_chunks - 1, offsets[-1]))
+            # the chunk ends after the end of the line of this offset
+            chunked_file.readline()
+            offset = chunked_file.tell()
+            if offset >= size:
+                break
+            if offset > offsets[-1]:
+                offsets.append(offset)
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+def iter_file_range(path, start, end, read_buffer_size=READ_BUFFER_SIZE):
+    '''
+    Iterates the lines of the given file between the given byte offsets,
+    which must be at the start of a line or at the end of the file
+    '''
+    with open(path, mode='rb', buffering=read_buffer_size) as range_file:
+        range_file.seek(start)
+        position = start
+        for line in range_file:
+            if position >= end:
+                break
+            position += len(line)
+            yield line
+
+def _tally_chunk(
+    question_index,
+    path,
+    start,
+    end,
+    engine_args,
+    withdrawals,
+    shared_counts_slab=None
+):
+    '''
+    Tallies a chunk of the file of a question in a worker process and returns
+    a pair with the state of its tally, see TallyEngine.get_question_state(),
+    and its invalid ballots. Encrypted invalid votes are counted by the engine
+    of the election, not here.
+
+    If shared_counts_slab is given, a pair with the name of a shared memory
+    and the index of a slab, the counts of the normal answers are written
+    there instead of being returned, see tally_methods.shared_counts.
+    '''
+    engine, invalid_vote_sink = _create_worker_engine(engine_args)
+    with engine:
+        engine.start(
+            questions=_worker_state.questions,
+            question_indexes=[question_index],
+            withdrawals=withdrawals
+        )
+        lines = iter_file_range(path, start, end, engine.read_buffer_size)
+        if os.path.basename(path) == HISTOGRAM_FILE_NAME:
+            engine.add_ballot_counts(question_index, iter_histogram_lines(lines))
+        else:
+            engine.add_ballots(question_index, lines)
+        if shared_counts_slab is not None:
+            tally = engine.tallies[question_index]
+            shared_counts.write_slab(*shared_counts_slab, tally)
+            tally.normal_answers = dict()
+        return (
+            engine.get_question_state(question_index),
+            _get_records(invalid_vote_sink)
+        )
+
+def add_file_chunks(
+    engine,
+    question_index,
+    path,
+    executor,
+    num_chunks,
+    min_chunk_size=MIN_CHUNK_SIZE,
+    use_shared_memory=False
+):
+    '''
+    Adds the ballots of the given question file to the given engine, splitting
+    it into up to num_chunks chunks of at least min_chunk_size bytes that are
+    tallied by the given executor, created by create_executor() with the
+    questions the engine was started with, and
+    merging their states in order. With use_shared_memory, the counts of the
+    normal answers of the chunks are returned in shared memory instead of
+    being pickled, which is cheaper for questions with many answers.
+
+    Files that can not be split, and questions whose voting system can not
+    merge its counts exactly (see BaseTally.is_merge_exact()), are read in
+    this process, so the results are always the same as those of a
+    sequential tally.
+    '''
+    num_chunks = min(
+        num_chunks,
+        max(os.path.getsize(path) // max(min_chunk_size, 1), 1)
+    )
+    tally = engine.tallies[question_index]
+    if (
+        num_chunks <= 1 or
+        os.path.basename(path) not in CHUNKED_FILE_NAMES or
+        not tally.is_merge_exact()
+    ):
+        return engine.add_ballots_file(question_index, path)
+
+    engine_args = _get_worker_engine_args(engine)
+    chunks = get_file_chunks(path, num_chunks)
+    counts_memory = None
+    if use_shared_memory:
+        counts_memory = shared_counts.create_shared_counts(tally, len(chunks))
+    try:
+        futures = [
+            executor.submit(
+                _tally_chunk,
+                question_index,
+                path,
+                start,
+                end,
+                engine_args,
+                engine.withdrawals,
+                (
+                    (counts_memory.name, chunk_index)
+                    if counts_memory is not None else None
+                )
+            )
+            for chunk_index, (start, end) in enumerate(chunks)
+        ]
+        count = 0
+        for future in futures:
+            question_state, records = future.result()
+            replay(records, engine.invalid_vote_sink)
+            engine.merge_question_state(question_index, question_state)
+            count += question_state['count']
+        if counts_memory is not None:
+            shared_counts.reduce_slabs(counts_memory, len(chunks), tally)
+        return count
+    finally:
+        if counts_memory is not None:
+            counts_memory.close()
+            counts_memory.unlink()
+
+def do_chunkedtally(
+    dir_path,
+    questions,
+    ignore_invalid_votes=False,
+    encrypted_invalid_votes=0,
+    monkey_patcher=None,
+    question_indexes=None,
+    withdrawals=None,
+    allow_empty_tally=False,
+    read_buffer_size=READ_BUFFER_SIZE,
+    dir_index=None,
+    workers=None,
+    min_chunk_size=MIN_CHUNK_SIZE,
+    use_shared_memory=False,
+    use_threads=False,
+    invalid_vote_sink=None
+):
+    '''
+    Tallies the election whose plaintexts are in the given directory and
+    returns the results, splitting the file of each question into chunks of
+    lines that are decoded concurrently by up to the given number of worker
+    processes, by default one per CPU. This speeds up elections with a few
+    very large questions, see add_file_chunks(), which is also where
+    use_shared_memory is described.
+
+    With use_threads, the chunks are tallied by a pool of threads instead,
+    which avoids starting processes and copying the questions to them, but
+    only decodes in parallel if is_gil_enabled() is False.
+
+    The invalid ballots found by the workers are reported to invalid_vote_sink
+    in this process, see tally_methods.invalid_votes.
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if use_threads and use_shared_memory:
+        raise Exception("shared memory can not be used with threads")
+    executor_class = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+    if dir_index is None:
+        dir_index = index_tally_dir(dir_path)
+
+    with TallyEngine(
+        ignore_invalid_votes=ignore_invalid_votes,
+        monkey_patcher=monkey_patcher,
+        allow_empty_tally=allow_empty_tally,
+        read_buffer_size=read_buffer_size,
+        invalid_vote_sink=invalid_vote_sink
+    ) as engine, create_executor(
+        executor_class,
+        workers,
+        questions
+    ) as executor:
+        engine.start(
+            questions=questions,
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            question_indexes=question_indexes,
+            withdrawals=withdrawals
+        )
+        for qindex in range(len(questions)):
+            if not engine.is_tallied(qindex):
+                continue
+            if qindex not in dir_index:
+                if not allow_empty_tally:
+                    raise IndexError(
+                        "no plaintexts found for question %d" % qindex
+                    )
+                continue
+
+            question_id, plaintexts_path = dir_index[qindex]
+            engine.tallies[qindex].question_id = question_id
+            add_file_chunks(
+                engine,
+                qindex,
+                plaintexts_path,
+                executor,
+                workers,
+                min_chunk_size,
+                use_shared_memory
+            )
+            engine.finish_question(qindex)
+        return engine.finish()
+
+def index_zip(tally_zip):
+    '''
+    Returns a dict whose keys are the question indexes and whose values are
+    the names of the plaintexts_json members of the given zip file, using the
+    first one by name for each question
+    '''
+    zip_index = dict()
+    for name in sorted(tally_zip.namelist()):
+        if os.path.basename(name) != PLAINTEXTS_NAMES[0]:
+            continue
+        question_dir_index = get_question_dir_index(name)
+        if question_dir_index is None:
+            continue
+        qindex = question_dir_index[0]
+        if qindex not in zip_index:
+            zip_index[qindex] = name
+    return zip_index
+
+def do_ziptally(
+    zip_path,
+    ignore_invalid_votes=False,
+    encrypted_invalid_votes=0,
+    monkey_patcher=None,
+    question_indexes=None,
+    withdrawals=None,
+    allow_empty_tally=False,
+    read_buffer_size=READ_BUFFER_SIZE,
+    workers=None,
+    invalid_vote_sink=None
+):
+    '''
+    Tallies the election in the given zip file, which has the same layout as
+    a tally directory, and returns the results. The zip central directory
+    allows opening each plaintexts_json member on its own, so the questions
+    are decompressed and tallied concurrently by up to the given number of
+    worker processes, by default one per CPU.
+    '''
+    with zipfile.ZipFile(zip_path) as tally_zip:
+        zip_index = index_zip(tally_zip)
+        member_sizes = dict(
+            (info.filename, info.file_size) for info in tally_zip.infolist()
+        )
+        names = tally_zip.namelist()
+        questions_name = (
+            "questions_json" if "questions_json" in names else "question_json"
+        )
+        questions = json.loads(tally_zip.read(questions_name).decode('utf-8'))
+
+    with TallyEngine(
+        ignore_invalid_votes=ignore_invalid_votes,
+        monkey_patcher=monkey_patcher,
+        allow_empty_tally=allow_empty_tally,
+        read_buffer_size=read_buffer_size,
+        invalid_vote_sink=invalid_vote_sink
+    ) as engine:
+        engine.start(
+            questions=questions,
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            question_indexes=question_indexes,
+            withdrawals=withdrawals
+        )
+
+        jobs = dict()
+        sizes = dict()
+        for qindex in range(len(questions)):
+            if not engine.is_tallied(qindex):
+                continue
+            if qindex not in zip_index:
+                if not allow_empty_tally:
+                    raise IndexError(
+                        "no plaintexts_json found for question %d" % qindex
+                    )
+                continue
+            jobs[qindex] = functools.partial(
+                add_zip_member,
+                zip_path,
+                zip_index[qindex]
+            )
+            sizes[qindex] = member_sizes[zip_index[qindex]]
+
+        tally_questions(engine, questions, jobs, workers, sizes)
+        return engine.finish()
@@ -0,0 +1,169 @@
+# This file is part of tally-methods.
+# Copyright (C) 2024  Sequent Tech Inc <legal@sequentech.io>
+
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Helpers to find, open and parse the plaintexts of each question
+'''
+
+import bz2
+import gzip
+import lzma
+import os
+import re
+
+from tally_methods.ballot_codec.int_parser import format_decimal, parse_decimal
+
+# size in bytes of the read buffer used when streaming plaintexts_json files.
+# Ballots are read line by line through this buffer, so memory usage does not
+# depend on the number of ballots in the file
+READ_BUFFER_SIZE = 1024 * 1024
+
+# accepted names of the per-question plaintexts files, in order of preference.
+# Compressed files are decompressed on the fly while being read
+PLAINTEXTS_NAMES = (
+    "plaintexts_json",
+    "plaintexts_json.gz",
+    "plaintexts_json.bz2",
+    "plaintexts_json.xz",
+)
+
+# name of the binary ballot file, see tally_methods.ballot_file
+BALLOT_FILE_NAME = "plaintexts_bin"
+
+# name of the histogram file, where each line has a distinct plaintext and the
+# number of times it was cast, see iter_histogram_lines()
+HISTOGRAM_FILE_NAME = "plaintexts_histogram_json"
+
+# all the accepted names of the per-question ballot files, in order of
+# preference
+QUESTION_FILE_NAMES = (
+    (BALLOT_FILE_NAME, HISTOGRAM_FILE_NAME) + PLAINTEXTS_NAMES
+)
+
+def get_question_dir_index(path):
+    '''
+    Given the path of a plaintexts file, returns a pair with the index of its
+    question and its question id, which is the name of the directory in which
+    it lives (for example "0-question"). Returns None if that directory name
+    does not start with the question index.
+    '''
+    question_id = os.path.basename(os.path.dirname(path))
+    match = re.match(r"^([0-9]+)-", question_id)
+    if match is None:
+        return None
+    return (int(match.group(1)), question_id)
+
+def index_tally_dir(dir_path):
+    '''
+    Scans a tally directory once and returns a dict whose keys are question
+    indexes and whose values are pairs with the question id (the name of the
+    question directory) and the path of its ballots file. If there are many
+    directories for the same question, the first one by name is used.
+    '''
+    dir_index = dict()
+    with os.scandir(dir_path) as entries:
+        question_dirs = sorted(
+            [entry for entry in entries if entry.is_dir()],
+            key=lambda entry: entry.name
+        )
+
+    for entry in question_dirs:
+        match = re.match(r"^([0-9]+)-", entry.name)
+        if match is None or int(match.group(1)) in dir_index:
+            continue
+
+        with os.scandir(entry.path) as file_entries:
+            file_names = set([file_entry.name for file_entry in file_entries])
+        for file_name in QUESTION_FILE_NAMES:
+            if file_name in file_names:
+                dir_index[int(match.group(1))] = (
+                    entry.name,
+                    os.path.join(entry.path, file_name)
+                )
+                break
+    return dir_index
+
+def open_plaintexts(path, read_buffer_size=READ_BUFFER_SIZE):
+    '''
+    Opens a plaintexts file for binary reading. If its name ends with .gz, .bz2
+    or .xz it is decompressed as it is read.
+    '''
+    if path.endswith(".gz"):
+        return gzip.open(path, mode='rb')
+    elif path.endswith(".bz2"):
+        return bz2.open(path, mode='rb')
+    elif path.endswith(".xz"):
+        return lzma.open(path, mode='rb')
+    else:
+        return open(path, mode='rb', buffering=read_buffer_size)
+
+def parse_plaintexts_line(line):
+    '''
+    Parses a line of a plaintexts_json file and returns the plaintext int.
+
+    Note line starts with " (1 character) and ends with "\n (2 characters), so
+    we trim beginning and end and parse the int. Ballots with long write-ins
+    can have thousands of digits, so they are parsed with parse_decimal().
+    '''
+    return parse_decimal(line[1:-2])
+
+def parse_plaintext(plaintext):
+    '''
+    Parses a plaintext given either as an int or as a decimal str or bytes,
+    optionally surrounded by double quotes, and returns the plaintext int.
+    '''
+    if isinstance(plaintext, int):
+        return plaintext
+    elif isinstance(plaintext, bytes):
+        return parse_decimal(plaintext.strip().strip(b'"'))
+    else:
+        return parse_decimal(plaintext.strip().strip('"'))
+
+def plaintext_to_str(plaintext):
+    '''
+    Returns a printable representation of a plaintext, as given to
+    TallyEngine.add_ballots()
+    '''
+    if isinstance(plaintext, bytes):
+        return plaintext.decode('utf-8', errors='replace')
+    elif isinstance(plaintext, int):
+        # str() refuses ints longer than the interpreter digit limit
+        return format_decimal(plaintext)
+    return str(plaintext)
+
+def iter_histogram_lines(histogram_file):
+    '''
+    Iterates the lines of a histogram file, yielding (plaintext, count) pairs.
+    Each line has a plaintext between double quotes, a comma and a positive
+    count, for example:
+
+        "13",1520
+
+    Lines without a valid count are yielded whole with a count of one, so that
+    a line with just a plaintext, like the ones of plaintexts_json, counts as
+    one ballot and any other line as a single invalid vote.
+    '''
+    for line in histogram_file:
+        plaintext, separator, count = line.rpartition(b',')
+        try:
+            if len(separator) == 0:
+                raise ValueError("missing separator")
+            count = int(count)
+            if count < 1:
+                raise ValueError("invalid count")
+        except ValueError:
+            yield (line, 1)
+        else:
+            yield (plaintext, count)
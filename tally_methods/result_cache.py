@@ -0,0 +1,150 @@
+# This file is part of tally-methods.
+# Copyright (C) 2024  Sequent Tech Inc <legal@sequentech.io>
+
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Content-addressed cache of the results of tallied questions.
+
+Each entry is a file named after a digest of everything the results of a
+question depend on: the question definition, its withdrawals, the encrypted
+invalid votes, the name and contents of its ballots file and the version of
+tally-methods. Unchanged questions are then served from the cache without
+decoding their ballots again. The invalid ballots of each question are
+cached with its results, so that they are reported again to the invalid vote
+sink of the tally.
+
+The digest does not cover the monkey_patcher given to the tally, so the
+cache should not be shared between tallies with different ones.
+'''
+
+import hashlib
+import json
+import os
+
+import tally_methods
+from tally_methods.ballot_codec.int_parser import format_decimal, parse_decimal
+
+# version of the format of the cache entries, part of their keys
+CACHE_VERSION = 2
+
+# size of the chunks read to digest the ballots files
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+def get_file_digest(path):
+    file_hash = hashlib.sha256()
+    with open(path, mode='rb') as ballots_file:
+        while True:
+            chunk = ballots_file.read(DIGEST_CHUNK_SIZE)
+            if len(chunk) == 0:
+                break
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def encode_plaintext(plaintext):
+    '''
+    Returns a JSON serializable pair with the type and the value of the
+    plaintext of an invalid ballot, which can be bytes, an int, a str or None
+    '''
+    if isinstance(plaintext, bytes):
+        return ['bytes', plaintext.decode('latin-1')]
+    elif isinstance(plaintext, int):
+        # json refuses ints longer than the interpreter digit limit
+        return ['int', format_decimal(plaintext)]
+    return ['str', plaintext]
+
+def decode_plaintext(encoded):
+    plaintext_type, value = encoded
+    if plaintext_type == 'bytes':
+        return value.encode('latin-1')
+    elif plaintext_type == 'int':
+        if value.startswith('-'):
+            return -parse_decimal(value[1:])
+        return parse_decimal(value)
+    return value
+
+class ResultCache(object):
+    '''
+    Stores the results of each tallied question in cache_dir, which is
+    created if needed
+    '''
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(
+        self,
+        question,
+        withdrawals,
+        encrypted_invalid_votes,
+        ballots_path
+    ):
+        '''
+        Returns the key of the results of a question, given its definition as
+        given to the tally, the ids of its withdrawn answers, the encrypted
+        invalid votes and the path of its ballots file
+        '''
+        data = json.dumps(
+            dict(
+                version=tally_methods.__version__,
+                cache_version=CACHE_VERSION,
+                question=question,
+                withdrawals=sorted(withdrawals),
+                encrypted_invalid_votes=encrypted_invalid_votes,
+                ballots_file_name=os.path.basename(ballots_path),
+                ballots_digest=get_file_digest(ballots_path)
+            ),
+            sort_keys=True,
+            ensure_ascii=True
+        )
+        return hashlib.sha256(data.encode('ascii')).hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key):
+        '''
+        Returns a tuple with the results of the question, its number of ballots
+        and its invalid ballots, or None if they are not in the cache
+        '''
+        path = self._get_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, mode='r', encoding='utf-8') as entry_file:
+            entry = json.load(entry_file)
+        invalid_votes = [
+            (decode_plaintext(plaintext), reason, count)
+            for plaintext, reason, count in entry['invalid_votes']
+        ]
+        return (entry['question'], entry['count'], invalid_votes)
+
+    def put(self, key, question, count, invalid_votes):
+        '''
+        Stores the results of a question, its number of ballots and its
+        invalid ballots, a list of (plaintext, reason, count) tuples
+        '''
+        path = self._get_path(key)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, mode='w', encoding='utf-8') as entry_file:
+            json.dump(
+                dict(
+                    question=question,
+                    count=count,
+                    invalid_votes=[
+                        [encode_plaintext(plaintext), reason, count]
+                        for plaintext, reason, count in invalid_votes
+                    ]
+                ),
+                entry_file
+            )
+        os.replace(tmp_path, path)
@@ -0,0 +1,195 @@
+# This file is part of tally-methods.
+# Copyright (C) 2024  Sequent Tech Inc <legal@sequentech.io>
+
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Tallies split in shards, so that the ballots of an election can be tallied by
+several machines.
+
+Each machine tallies a tally directory with a part of the ballots of each
+question and writes a shard file with the state of its tally objects, see
+TallyEngine.get_question_state(). The shard files are then merged and each
+question is post processed once, which gives the same results as tallying all
+the ballots together. The only exception are voting systems with fractional
+points, like borda-nauru, whose float totals can differ in the last digits, see
+BaseTally.is_merge_exact().
+
+Shard files are JSON documents with a version and a digest of the election, so
+that only shards of the same election are merged. Encrypted invalid votes are
+not counted in the shards, but when merging them.
+
+Usage:
+
+    python -m tally_methods.shard shard <tally_path> <shard_path>
+    python -m tally_methods.shard merge <questions_path> <shard_path>...
+'''
+
+import json
+import os
+import sys
+
+from tally_methods import checkpoint, file_helpers
+from tally_methods.plaintexts import READ_BUFFER_SIZE, index_tally_dir
+from tally_methods.tally import TallyEngine
+
+SHARD_VERSION = 1
+
+def get_shard_digest(questions, question_indexes, withdrawals):
+    '''
+    Returns the digest of the election of a shard. Shards do not count the
+    encrypted invalid votes, so they are not part of it.
+    '''
+    return checkpoint.get_election_digest(
+        questions,
+        0,
+        question_indexes,
+        withdrawals
+    )
+
+def read_shard(shard_path, shard_digest):
+    '''
+    Reads a shard file, checking that it belongs to the election with the
+    given digest
+    '''
+    with open(shard_path, mode='r', encoding='utf-8') as shard_file:
+        shard = json.load(shard_file)
+    if shard.get('version') != SHARD_VERSION:
+        raise Exception(
+            "unsupported shard version %r in %s" % (
+                shard.get('version'),
+                shard_path
+            )
+        )
+    if shard['election_digest'] != shard_digest:
+        raise Exception(
+            "the shard %s belongs to a different election" % shard_path
+        )
+    return shard
+
+def do_shardtally(
+    dir_path,
+    questions,
+    shard_path,
+    ignore_invalid_votes=False,
+    monkey_patcher=None,
+    question_indexes=None,
+    withdrawals=None,
+    read_buffer_size=READ_BUFFER_SIZE,
+    dir_index=None,
+    invalid_vote_sink=None
+):
+    '''
+    Tallies the ballots of the given directory, a shard of the ballots of the
+    election, and writes the state of the tally of each question found there
+    to shard_path. The questions without ballots in this shard are left out.
+    Invalid ballots are reported to invalid_vote_sink if given, see
+    tally_methods.invalid_votes.
+    '''
+    if dir_index is None:
+        dir_index = index_tally_dir(dir_path)
+
+    with TallyEngine(
+        ignore_invalid_votes=ignore_invalid_votes,
+        monkey_patcher=monkey_patcher,
+        read_buffer_size=read_buffer_size,
+        invalid_vote_sink=invalid_vote_sink
+    ) as engine:
+        engine.start(
+            questions=questions,
+            question_indexes=question_indexes,
+            withdrawals=withdrawals
+        )
+        shard = dict(
+            version=SHARD_VERSION,
+            election_digest=get_shard_digest(
+                questions,
+                question_indexes,
+                withdrawals
+            ),
+            questions=dict()
+        )
+        for qindex in range(len(questions)):
+            if not engine.is_tallied(qindex) or qindex not in dir_index:
+                continue
+            engine.add_ballots_file(qindex, dir_index[qindex][1])
+            shard['questions'][str(qindex)] = engine.get_question_state(qindex)
+
+    file_helpers.write_json_file(shard_path, shard, compact=True)
+    return shard
+
+def do_mergetally(
+    shard_paths,
+    questions,
+    ignore_invalid_votes=False,
+    encrypted_invalid_votes=0,
+    monkey_patcher=None,
+    question_indexes=None,
+    withdrawals=None,
+    allow_empty_tally=False
+):
+    '''
+    Merges the given shard files, written by do_shardtally() for the same
+    election, post processes each question once and returns the results
+    '''
+    shard_digest = get_shard_digest(questions, question_indexes, withdrawals)
+    with TallyEngine(
+        ignore_invalid_votes=ignore_invalid_votes,
+        monkey_patcher=monkey_patcher,
+        allow_empty_tally=allow_empty_tally
+    ) as engine:
+        engine.start(
+            questions=questions,
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            question_indexes=question_indexes,
+            withdrawals=withdrawals
+        )
+        merged_questions = set()
+        for shard_path in shard_paths:
+            shard = read_shard(shard_path, shard_digest)
+            for qindex_str, question_state in shard['questions'].items():
+                qindex = int(qindex_str)
+                engine.merge_question_state(qindex, question_state)
+                merged_questions.add(qindex)
+
+        for qindex in range(len(questions)):
+            if (
+                engine.is_tallied(qindex) and
+                qindex not in merged_questions and
+                not allow_empty_tally
+            ):
+                raise IndexError("no shard has ballots of question %d" % qindex)
+        return engine.finish()
+
+def _read_questions(path):
+    if os.path.isdir(path):
+        path = os.path.join(path, 'questions_json')
+    return json.loads(file_helpers.read_file(path))
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) == 3 and args[0] == "shard":
+        do_shardtally(args[1], _read_questions(args[1]), args[2])
+    elif len(args) >= 3 and args[0] == "merge":
+        results = do_mergetally(args[2:], _read_questions(args[1]))
+        file_helpers.write_json(results, sys.stdout)
+        sys.stdout.write("\n")
+    else:
+        print(
+            "usage: %s shard <tally_path> <shard_path>\n"
+            "       %s merge <questions_path> <shard_path>..." % (
+                sys.argv[0],
+                sys.argv[0]
+            )
+        )
+        exit(1)
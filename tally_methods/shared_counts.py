@@ -0,0 +1,105 @@
+# This file is part of tally-methods.
+# Copyright (C) 2024  Sequent Tech Inc <legal@sequentech.io>
+
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Counts of the normal answers of a question in shared memory, used to return
+them from worker processes without pickling them.
+
+The shared memory holds one slab per worker task, an array of 64 bit ints with
+a row per normal answer, in the order of their ids. Each row has the total
+count of the answer followed by its voters_by_position, if the voting system
+counts them. Each worker writes the counts of its tally object to its own
+slab, and the slabs are added to the tally object of the question once all the
+workers are done.
+
+Counts must be ints, so this is only used with voting systems whose counts
+can be merged exactly, see BaseTally.is_merge_exact().
+'''
+
+from multiprocessing import shared_memory
+
+# size in bytes of each count
+COUNT_SIZE = 8
+
+def get_layout(tally):
+    '''
+    Returns a pair with the sorted ids of the normal answers of the given
+    tally object, after pre_tally(), and the number of positions counted in
+    their voters_by_position, which is 0 if the voting system does not count
+    them
+    '''
+    answer_ids = sorted(tally.normal_answers)
+    num_positions = 0
+    if len(answer_ids) > 0:
+        num_positions = len(
+            tally.normal_answers[answer_ids[0]].get('voters_by_position', [])
+        )
+    return (answer_ids, num_positions)
+
+def create_shared_counts(tally, num_slabs):
+    '''
+    Creates the shared memory for num_slabs slabs of counts of the given tally
+    object, initialized to zero. The caller must close and unlink it.
+    '''
+    answer_ids, num_positions = get_layout(tally)
+    size = num_slabs * len(answer_ids) * (1 + num_positions) * COUNT_SIZE
+    return shared_memory.SharedMemory(create=True, size=max(size, COUNT_SIZE))
+
+def write_slab(shared_memory_name, slab_index, tally):
+    '''
+    Writes the counts of the normal answers of the given tally object to the
+    given slab of the shared memory with the given name
+    '''
+    answer_ids, num_positions = get_layout(tally)
+    row_size = 1 + num_positions
+    slab_size = len(answer_ids) * row_size
+
+    counts_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    counts = counts_memory.buf.cast('q')
+    try:
+        offset = slab_index * slab_size
+        for answer_id in answer_ids:
+            answer = tally.normal_answers[answer_id]
+            counts[offset] = answer['total_count']
+            if num_positions > 0:
+                for position, voters in enumerate(answer['voters_by_position']):
+                    counts[offset + 1 + position] = voters
+            offset += row_size
+    finally:
+        # the buffer must be released before closing the shared memory
+        counts.release()
+        counts_memory.close()
+
+def reduce_slabs(counts_memory, num_slabs, tally):
+    '''
+    Adds the counts of all the slabs of the given shared memory to the normal
+    answers of the given tally object
+    '''
+    answer_ids, num_positions = get_layout(tally)
+    row_size = 1 + num_positions
+    slab_size = len(answer_ids) * row_size
+
+    counts = counts_memory.buf.cast('q')
+    try:
+        for index, answer_id in enumerate(answer_ids):
+            answer = tally.normal_answers[answer_id]
+            for slab_index in range(num_slabs):
+                offset = slab_index * slab_size + index * row_size
+                answer['total_count'] += counts[offset]
+                for position in range(num_positions):
+                    answer['voters_by_position'][position] += \
+                        counts[offset + 1 + position]
+    finally:
+        counts.release()
@@ -16,49 +16,68 @@
 # along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from tally_methods import tar_index, ballot_file, checkpoint, file_helpers
+from tally_methods.result_cache import ResultCache
+from tally_methods.invalid_votes import (
+    PrintInvalidVoteSink,
+    RecordingInvalidVoteSink,
+    get_invalid_reason,
+    replay
+)
+from tally_methods.plaintexts import (
+    READ_BUFFER_SIZE,
+    BALLOT_FILE_NAME,
+    HISTOGRAM_FILE_NAME,
+    get_question_dir_index,
+    iter_histogram_lines,
+    index_tally_dir,
+    open_plaintexts,
+    parse_plaintexts_line,
+    parse_plaintext
+)
 from tally_methods.voting_systems.base import (
+    copy_question,
     get_voting_system_by_id,
-    BlankVoteException
+    BlankVoteException,
+    VoteRecord
 )
 
 import copy
-import glob
 import codecs
+import itertools
 import tarfile
 import json
 import os
 import sys
-from tempfile import mkdtemp
-
-def do_tartally(tally_path):
-    dir_path = mkdtemp("tally")
-
-    # untar the plaintexts
-    tally_gz = tarfile.open(tally_path, mode="r:gz")
-    paths = tally_gz.getnames()
-    plaintexts_paths = [path for path in paths if path.endswith("/plaintexts_json")]
-
-    member = tally_gz.getmember("question_json")
-    member.name = "question_json"
-    tally_gz.extract(member, path=dir_path)
-    questions_path = os.path.join(dir_path, 'question_json')
-    with codecs.open(questions_path, encoding='utf-8', mode='r') as questions_f:
-        questions = json.loads(questions_f.read())
 
-    for plaintexts_path in plaintexts_paths:
-        member = tally_gz.getmember(plaintexts_path)
-        base = os.path.basename(os.path.dirname(plaintexts_path))
-        subdir = os.path.join(dir_path, base)
-        member.name = os.path.join(base, "plaintexts_json")
-        os.makedirs(subdir)
-        tally_gz.extract(member, path=dir_path)
-
-    return do_tally(dir_path, questions)
+def do_tartally(
+    tally_path,
+    ignore_invalid_votes=False,
+    encrypted_invalid_votes=0,
+    question_indexes=None,
+    read_buffer_size=READ_BUFFER_SIZE,
+    index_path=None,
+    invalid_vote_sink=None
+):
+    with TallyEngine(
+        ignore_invalid_votes=ignore_invalid_votes,
+        read_buffer_size=read_buffer_size,
+        invalid_vote_sink=invalid_vote_sink
+    ) as engine:
+        return engine.tally_tar(
+            tally_path=tally_path,
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            question_indexes=question_indexes,
+            index_path=index_path
+        )
 
 def do_dirtally(
     dir_path, 
     ignore_invalid_votes=False, 
-    encrypted_invalid_votes=0
+    encrypted_invalid_votes=0,
+    read_buffer_size=READ_BUFFER_SIZE,
+    jobs=None,
+    invalid_vote_sink=None
 ):
     res_path = os.path.join(dir_path, 'questions_json')
     with codecs.open(res_path, encoding='utf-8', mode='r') as res_f:
@@ -68,163 +87,1022 @@ def do_dirtally(
         dir_path=dir_path, 
         questions=questions,
         ignore_invalid_votes=ignore_invalid_votes,
-        encrypted_invalid_votes=encrypted_invalid_votes
+        encrypted_invalid_votes=encrypted_invalid_votes,
+        read_buffer_size=read_buffer_size,
+        jobs=jobs,
+        invalid_vote_sink=invalid_vote_sink
     )
 
-def do_tally(
-    dir_path, 
-    questions, 
-    tallies=[], 
-    ignore_invalid_votes=False,
-    encrypted_invalid_votes=0,
-    monkey_patcher=None,
-    question_indexes=None, 
-    withdrawals=[], 
-    allow_empty_tally=False
-):
-    # questions is in the same format as get_questions_pretty(). Initialized here
-    questions = copy.deepcopy(questions)
-    base_vote =[dict(choices=[]) for q in questions]
-    total_count = encrypted_invalid_votes
-
-    # setup the initial data common to all voting systems
-    question_index = 0
-    for qindex, question in enumerate(questions):
-
-        tally_type = question['tally_type']
-        voting_system = get_voting_system_by_id(tally_type)
-        tally = voting_system.create_tally(
-            question=question,
-            question_num=question_index
-        )
-        if monkey_patcher:
-            monkey_patcher(tally)
-        tallies.append(tally)
-
-        # initialize to some defaults if not Initialized
-        if 'winners' not in question:
+class TallyEngine(object):
+    '''
+    Tallies elections. The engine owns the tally objects of the election being
+    tallied, and can be reused to tally multiple elections one after the other.
+    All the references to the last tallied election are released on close(),
+    which is also called when used as a context manager.
+    '''
+    questions = None
+    tallies = None
+    question_indexes = None
+    withdrawals = None
+    encrypted_invalid_votes = 0
+
+    # number of ballots read for each tallied question, including the
+    # encrypted invalid votes
+    question_counts = None
+
+    def __init__(
+        self,
+        ignore_invalid_votes=False,
+        monkey_patcher=None,
+        allow_empty_tally=False,
+        read_buffer_size=READ_BUFFER_SIZE,
+        invalid_vote_sink=None
+    ):
+        self.ignore_invalid_votes = ignore_invalid_votes
+        self.monkey_patcher = monkey_patcher
+        self.allow_empty_tally = allow_empty_tally
+        self.read_buffer_size = read_buffer_size
+
+        # invalid ballots are reported to the given sink, and by default
+        # printed unless ignore_invalid_votes is set
+        if invalid_vote_sink is None and not ignore_invalid_votes:
+            invalid_vote_sink = PrintInvalidVoteSink()
+        self.invalid_vote_sink = invalid_vote_sink
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''
+        Releases the questions and tally objects of the last tallied election
+        '''
+        self.questions = None
+        self.tallies = []
+        self.question_indexes = None
+        self.withdrawals = []
+        self.encrypted_invalid_votes = 0
+        self.question_counts = dict()
+        self.finished_questions = set()
+        self.checkpoint_path = None
+        self.checkpoint_interval = checkpoint.CHECKPOINT_INTERVAL
+        self.checkpoint = None
+        self.unsynced_count = 0
+
+    def is_tallied(self, question_index):
+        '''
+        Returns True if the question with the given index is being tallied
+        '''
+        return (
+            self.question_indexes is None or
+            question_index in self.question_indexes
+        )
+
+    def start(
+        self,
+        questions,
+        encrypted_invalid_votes=0,
+        question_indexes=None,
+        withdrawals=None
+    ):
+        '''
+        Prepares the tally of an election, releasing any previous one. Ballots
+        are then added with add_ballots() and the tally is finished with
+        finish().
+        '''
+        self.close()
+        # questions is in the same format as get_questions_pretty(). 
+        # Initialized here
+        self.questions = [copy_question(question) for question in questions]
+        self.question_indexes = question_indexes
+        self.withdrawals = withdrawals if withdrawals is not None else []
+        self.encrypted_invalid_votes = encrypted_invalid_votes
+
+        # setup the initial data common to all voting systems. Tally objects
+        # are only created for the tallied questions, the rest are None
+        for qindex, question in enumerate(self.questions):
+            # initialize to some defaults if not Initialized
+            if 'winners' not in question:
+                question['winners'] = []
+            if 'totals' not in question:
+                question['totals'] = dict(
+                    blank_votes=0,
+                    null_votes=encrypted_invalid_votes,
+                    valid_votes=0
+                )
+            for answer in question['answers']:
+                if "total_count" not in answer:
+                    answer['total_count'] = 0
+
+            if not self.is_tallied(qindex):
+                self.tallies.append(None)
+                continue
+
+            tally_type = question['tally_type']
+            voting_system = get_voting_system_by_id(tally_type)
+            tally = voting_system.create_tally(
+                question=question,
+                question_num=qindex
+            )
+            if self.monkey_patcher:
+                self.monkey_patcher(tally)
+            self.tallies.append(tally)
+
             question['winners'] = []
-        if 'totals' not in question:
             question['totals'] = dict(
                 blank_votes=0,
                 null_votes=encrypted_invalid_votes,
                 valid_votes=0
             )
-        for answer in question['answers']:
-            if "total_count" not in answer:
+
+            for answer in question['answers']:
                 answer['total_count'] = 0
 
-        if question_indexes is not None and qindex not in question_indexes:
-            question_index += 1
-            continue
+            tally.pre_tally(self.questions)
 
-        question['winners'] = []
-        question['totals'] = dict(
-            blank_votes=0,
-            null_votes=encrypted_invalid_votes,
-            valid_votes=0
+    def get_question_withdrawals(self, question_index):
+        '''
+        Returns the ids of the withdrawn answers of the given question
+        '''
+        return [
+            answer['answer_id']
+            for answer in self.withdrawals
+            if answer['question_index'] == question_index
+        ]
+
+    def add_ballots(
+        self,
+        question_index,
+        lines,
+        parse_ballot=parse_plaintexts_line
+    ):
+        '''
+        Adds to the tally of the given question the ballots in the given
+        iterable. By default it is an iterable of plaintexts_json lines, but
+        other formats can be used by giving the function that parses each
+        element of the iterable into its plaintext int.
+        '''
+        return self.add_ballot_counts(
+            question_index,
+            zip(lines, itertools.repeat(1)),
+            parse_ballot
         )
 
-        for answer in question['answers']:
-            answer['total_count'] = 0
+    def add_ballot_counts(
+        self,
+        question_index,
+        ballot_counts,
+        parse_ballot=parse_plaintext
+    ):
+        '''
+        Adds to the tally of the given question the ballots in the given
+        iterable of (ballot, count) pairs, where count is the number of times
+        the ballot was cast. Each ballot is parsed with parse_ballot and
+        decoded only once, and then added count times. A count below one
+        raises a ValueError, leaving the pairs before it added.
+        '''
+        question = self.questions[question_index]
+        tally = self.tallies[question_index]
+        q_withdrawals = self.get_question_withdrawals(question_index)
 
-        tally.pre_tally(questions)
-        plaintexts_path = os.path.join(
-            dir_path, 
-            "%d-*" % question_index, 
-            "plaintexts_json"
-        )
+        total_count = 0
+        for line, count in ballot_counts:
+            if count < 1:
+                raise ValueError(
+                    "invalid count %r of ballot %r" % (count, line)
+                )
+            total_count += count
+            vote = VoteRecord(count=count)
+            int_ballot = None
+            try:
+                # The plaintext contains the index of the option
+                # selected by the user but starting with 1 because
+                # number 0 cannot be encrypted with elgammal so we
+                # parse the int and substract one
+                int_ballot = parse_ballot(line) - 1
+                choices = tally.parse_vote(
+                    int_ballot, 
+                    question, 
+                    q_withdrawals
+                )
+                #print("valid ballot with choices: %r" % int_ballot)
+                #print(choices)
+
+                # craft the vote in the format admitted by
+                # tally.add_vote
+                vote.choices = choices
+            except BlankVoteException:
+                #print("blank ballot %r" % line)
+                vote.is_blank = True
+                question['totals']['blank_votes'] += count
+            except Exception as e:
+                #print("invalid ballot %r" % line)
+                vote.is_null = True
+                question['totals']['null_votes'] += count
+                if self.invalid_vote_sink is not None:
+                    self.invalid_vote_sink.add(
+                        question_index,
+                        line,
+                        get_invalid_reason(e, int_ballot),
+                        count
+                    )
+
+            tally.add_vote(
+                voter_answers=vote,
+                questions=self.questions, 
+                is_delegated=False
+            )
+
+        self.question_counts[question_index] = self.question_counts.get(
+            question_index,
+            self.encrypted_invalid_votes
+        ) + total_count
+        return total_count
+
+    def _get_total_votes(self):
+        # total_votes are the ones of the last question with ballots
+        if len(self.question_counts) > 0:
+            return self.question_counts[max(self.question_counts)]
+        else:
+            return self.encrypted_invalid_votes
+
+    def finish_question(self, question_index):
+        '''
+        Post processes the tally of the given question, once all its ballots
+        have been added, and returns its results. finish() will not post
+        process it again.
+        '''
+        if question_index not in self.finished_questions:
+            self.tallies[question_index].post_tally(self.questions)
+            self.finished_questions.add(question_index)
+        return self.questions[question_index]
+
+    def set_question_results(
+        self,
+        question_index,
+        question,
+        count,
+        invalid_votes=()
+    ):
+        '''
+        Sets the results and the number of ballots of a question that was
+        tallied elsewhere, for example taken from a cache or tallied by another
+        process, and returns them. The tally object of the question is left
+        untouched and is not post processed.
+
+        The given invalid ballots of the question, (plaintext, reason, count)
+        tuples, are reported to the invalid vote sink.
+        '''
+        if self.invalid_vote_sink is not None:
+            for plaintext, reason, invalid_count in invalid_votes:
+                self.invalid_vote_sink.add(
+                    question_index,
+                    plaintext,
+                    reason,
+                    invalid_count
+                )
+        self.questions[question_index] = question
+        self.question_counts[question_index] = count
+        self.finished_questions.add(question_index)
+        return question
+
+    def record_invalid_votes(self, function, *args):
+        '''
+        Calls function with the given arguments, keeping the invalid ballots
+        reported meanwhile, which are then reported to the invalid vote sink.
+        Returns them as a list of (plaintext, reason, count) tuples, whether
+        the engine has an invalid vote sink or not.
+        '''
+        invalid_vote_sink = self.invalid_vote_sink
+        recording_sink = RecordingInvalidVoteSink()
+        self.invalid_vote_sink = recording_sink
         try:
-            plaintexts_path = glob.glob(plaintexts_path)[0]
-            tally.question_id = plaintexts_path.split('/')[-2]
-        except IndexError as e:
-            if not allow_empty_tally:
-                raise e
-            else:
-                pass
+            function(*args)
+        finally:
+            self.invalid_vote_sink = invalid_vote_sink
+        if invalid_vote_sink is not None:
+            replay(recording_sink.records, invalid_vote_sink)
+        return [
+            (plaintext, reason, count)
+            for _, plaintext, reason, count in recording_sink.records
+        ]
+
+    def finish(self):
+        '''
+        Post processes the tally and returns the results
+        '''
+        # post process the tally
+        for qindex in range(len(self.tallies)):
+            if not self.is_tallied(qindex):
+                continue
+            self.finish_question(qindex)
+
+        return dict(
+            questions = self.questions,
+            total_votes = self._get_total_votes()
+        )
+
+    def snapshot(self):
+        '''
+        Returns the results of the ballots added so far, in the same format as
+        finish(), while the tally goes on. post_tally modifies the tally
+        objects, so it is called on a copy of them. The decoders are read-only
+        and shared with the copy.
+        '''
+        memo = dict(
+            (id(tally.decoder), tally.decoder)
+            for tally in self.tallies
+            if tally is not None
+        )
+        questions, tallies = copy.deepcopy((self.questions, self.tallies), memo)
+        for qindex, tally in enumerate(tallies):
+            if (
+                not self.is_tallied(qindex) or
+                qindex in self.finished_questions
+            ):
+                continue
+            tally.post_tally(questions)
+
+        return dict(
+            questions = questions,
+            total_votes = self._get_total_votes()
+        )
+
+    def add_ballots_file(self, question_index, path, offset=0):
+        '''
+        Adds to the tally of the given question the ballots in the given file,
+        which can be either a binary ballot file, a histogram file or a
+        (possibly compressed) plaintexts_json file, starting at the given
+        offset. If checkpoints are enabled, one is saved every
+        checkpoint_interval ballots.
+        '''
+        file_name = os.path.basename(path)
+        if file_name == BALLOT_FILE_NAME:
+            ballots_file = ballot_file.BallotFileReader(path)
+            add_ballots = lambda ballots: self.add_ballots(
+                question_index,
+                ballots,
+                ballot_file.parse_ballot
+            )
+        elif file_name == HISTOGRAM_FILE_NAME:
+            ballots_file = open_plaintexts(path, self.read_buffer_size)
+            add_ballots = lambda lines: self.add_ballot_counts(
+                question_index,
+                iter_histogram_lines(lines)
+            )
         else:
-            q_withdrawals = [
-                answer['answer_id']
-                for answer in withdrawals
-                if answer['question_index'] == qindex
-            ]
-
-            with codecs.open(
-                plaintexts_path, 
-                encoding='utf-8', 
-                mode='r'
-            ) as plaintexts_file:
-                total_count = encrypted_invalid_votes
-                for line in plaintexts_file.readlines():
-                    total_count += 1
-                    voter_answers = copy.deepcopy(base_vote)
-                    voter_answers[question_index]['choices'] = None
-                    voter_answers[question_index]['is_blank'] = False
-                    voter_answers[question_index]['is_null'] = False
-                    int_ballot = None
-                    try:
-                        # Note line starts with " (1 character) and ends with
-                        # "\n (2 characters). It contains the index of the
-                        # option selected by the user but starting with 1
-                        # because number 0 cannot be encrypted with elgammal
-                        # so we trim beginning and end, parse the int and
-                        # substract one
-                        int_ballot = int(line[1:-2]) - 1
-                        choices = tally.parse_vote(
-                            int_ballot, 
-                            question, 
-                            q_withdrawals
+            # the file is streamed line by line through a buffered reader, so
+            # that only one ballot is kept in memory at a time
+            ballots_file = open_plaintexts(path, self.read_buffer_size)
+            add_ballots = lambda lines: self.add_ballots(question_index, lines)
+
+        with ballots_file:
+            if offset > 0:
+                ballots_file.seek(offset)
+            if self.checkpoint is None:
+                return add_ballots(ballots_file)
+
+            count = 0
+            while True:
+                batch_count = add_ballots(
+                    itertools.islice(ballots_file, self.checkpoint_interval)
+                )
+                if batch_count == 0:
+                    break
+                count += batch_count
+                self.unsynced_count += batch_count
+                self.save_checkpoint(
+                    question_index,
+                    file_name,
+                    ballots_file.tell(),
+                    finished=False
+                )
+            self.save_checkpoint(
+                question_index,
+                file_name,
+                ballots_file.tell(),
+                finished=True
+            )
+            return count
+
+    def save_checkpoint(self, question_index, file_name, offset, finished):
+        '''
+        Saves a checkpoint recording that the ballots file of the given
+        question has been read up to the given offset, with the state of its
+        tally. Questions are read one after the other, so the state saved for
+        the previous questions is still valid, and only this question is
+        appended to the checkpoint file. It is flushed to disk once at least
+        checkpoint_interval ballots were added since the last time.
+        '''
+        sync = self.unsynced_count >= self.checkpoint_interval
+        checkpoint.append_checkpoint(
+            self.checkpoint_path,
+            question_index,
+            dict(
+                file_name=file_name,
+                offset=offset,
+                finished=finished,
+                **self.get_question_state(question_index)
+            ),
+            sync=sync
+        )
+        if sync:
+            self.unsynced_count = 0
+
+    def get_question_state(self, question_index):
+        '''
+        Returns the number of ballots, the totals and the state of the tally
+        object of the given question as a JSON serializable dict, which can be
+        added to the tally of the same question by another engine with
+        merge_question_state()
+        '''
+        return dict(
+            count=self.question_counts.get(
+                question_index,
+                self.encrypted_invalid_votes
+            ),
+            totals=self.questions[question_index]['totals'],
+            state=self.tallies[question_index].get_state()
+        )
+
+    def merge_question_state(self, question_index, question_state):
+        '''
+        Adds to the tally of the given question the ballots counted by another
+        engine, given the result of its get_question_state(). That engine must
+        have been started with no encrypted invalid votes, as these are already
+        counted by this one.
+        '''
+        totals = self.questions[question_index]['totals']
+        for key, value in question_state['totals'].items():
+            totals[key] += value
+        self.question_counts[question_index] = self.question_counts.get(
+            question_index,
+            self.encrypted_invalid_votes
+        ) + question_state['count']
+        self.tallies[question_index].merge_state(question_state['state'])
+
+    def _load_checkpoint(self):
+        '''
+        Starts the checkpoints of the started tally, restoring the state of the
+        previous checkpoint if there is one
+        '''
+        election_digest = checkpoint.get_election_digest(
+            self.questions,
+            self.encrypted_invalid_votes,
+            self.question_indexes,
+            self.withdrawals
+        )
+        if not os.path.exists(self.checkpoint_path):
+            checkpoint.create_checkpoint(self.checkpoint_path, election_digest)
+            self.checkpoint = dict(
+                version=checkpoint.CHECKPOINT_VERSION,
+                election_digest=election_digest,
+                questions=dict()
+            )
+            return
+
+        self.checkpoint = checkpoint.read_checkpoint(
+            self.checkpoint_path,
+            election_digest
+        )
+        for qindex, question_checkpoint in self.checkpoint['questions'].items():
+            self.question_counts[qindex] = question_checkpoint['count']
+            self.questions[qindex]['totals'] = question_checkpoint['totals']
+            self.tallies[qindex].set_state(question_checkpoint['state'])
+
+    def tally(
+        self,
+        dir_path,
+        questions,
+        encrypted_invalid_votes=0,
+        question_indexes=None,
+        withdrawals=None,
+        dir_index=None,
+        checkpoint_path=None,
+        checkpoint_interval=checkpoint.CHECKPOINT_INTERVAL,
+        result_cache=None
+    ):
+        '''
+        Tallies the election whose plaintexts are in the given directory and
+        returns the results. The directory is scanned once with
+        index_tally_dir(), unless its result is given as dir_index.
+
+        If a checkpoint_path is given, a checkpoint is saved there every
+        checkpoint_interval ballots, and if it already exists the tally is
+        resumed from it. It is removed once the tally finishes.
+
+        If a result_cache is given, the results of the questions whose inputs
+        have not changed are taken from it instead of tallying them, and the
+        results of the rest are added to it. The tally objects of the
+        questions taken from the cache are not post processed, and their
+        cached invalid ballots are reported to the invalid vote sink. The
+        questions resumed from a checkpoint are not cached, as their invalid
+        ballots are not all known.
+        '''
+        for _ in self.iter_tally(
+            dir_path=dir_path,
+            questions=questions,
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            question_indexes=question_indexes,
+            withdrawals=withdrawals,
+            dir_index=dir_index,
+            checkpoint_path=checkpoint_path,
+            checkpoint_interval=checkpoint_interval,
+            result_cache=result_cache
+        ):
+            pass
+        return self.finish()
+
+    def iter_tally(
+        self,
+        dir_path,
+        questions,
+        encrypted_invalid_votes=0,
+        question_indexes=None,
+        withdrawals=None,
+        dir_index=None,
+        checkpoint_path=None,
+        checkpoint_interval=checkpoint.CHECKPOINT_INTERVAL,
+        result_cache=None
+    ):
+        '''
+        Generator that tallies the election whose plaintexts are in the given
+        directory one question at a time, yielding a pair with the index and
+        the results of each tallied question as soon as its post_tally has run.
+        The arguments are the same as in tally(), and finish() returns the
+        results of the whole election afterwards.
+        '''
+        self.start(
+            questions=questions,
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            question_indexes=question_indexes,
+            withdrawals=withdrawals
+        )
+        if checkpoint_path is not None:
+            self.checkpoint_path = checkpoint_path
+            self.checkpoint_interval = checkpoint_interval
+            self._load_checkpoint()
+        if dir_index is None:
+            dir_index = index_tally_dir(dir_path)
+
+        for qindex in range(len(self.questions)):
+            if not self.is_tallied(qindex):
+                continue
+
+            if qindex not in dir_index:
+                if not self.allow_empty_tally:
+                    raise IndexError(
+                        "no plaintexts found for question %d" % qindex
+                    )
+                yield (qindex, self.finish_question(qindex))
+                continue
+
+            question_id, plaintexts_path = dir_index[qindex]
+            self.tallies[qindex].question_id = question_id
+
+            if result_cache is not None:
+                cache_key = result_cache.get_key(
+                    questions[qindex],
+                    self.get_question_withdrawals(qindex),
+                    self.encrypted_invalid_votes,
+                    plaintexts_path
+                )
+                cached = result_cache.get(cache_key)
+                if cached is not None:
+                    yield (qindex, self.set_question_results(qindex, *cached))
+                    continue
+
+            offset = 0
+            if self.checkpoint is not None:
+                question_checkpoint = self.checkpoint['questions'].get(qindex)
+                if question_checkpoint is not None:
+                    if (
+                        question_checkpoint['file_name'] !=
+                        os.path.basename(plaintexts_path)
+                    ):
+                        raise Exception(
+                            "the checkpoint of question %d was saved while "
+                            "reading %s" % (qindex, question_checkpoint['file_name'])
                         )
-                        #print("valid ballot with choices: %r" % int_ballot)
-                        #print(choices)
-
-                        # craft the voter_answers in the format admitted by
-                        # tally.add_vote
-                        voter_answers[question_index]['choices'] = choices
-                    except BlankVoteException:
-                        #print("blank ballot %r" % line)
-                        voter_answers[question_index]['is_blank'] = True
-                        question['totals']['blank_votes'] += 1
-                    except Exception as e:
-                        #print("invalid ballot %r" % line)
-                        voter_answers[question_index]['is_null'] = True
-                        question['totals']['null_votes'] += 1
-                        if not ignore_invalid_votes:
-                            print("invalid vote: " + line)
-
-                    tally.add_vote(
-                        voter_answers=voter_answers,
-                        questions=questions, 
-                        is_delegated=False
+                    offset = question_checkpoint['offset']
+                    if question_checkpoint['finished']:
+                        offset = None
+
+            invalid_votes = None
+            if result_cache is not None and offset == 0:
+                invalid_votes = self.record_invalid_votes(
+                    self.add_ballots_file,
+                    qindex,
+                    plaintexts_path
+                )
+            elif offset is not None:
+                self.add_ballots_file(qindex, plaintexts_path, offset)
+            question = self.finish_question(qindex)
+            if invalid_votes is not None:
+                result_cache.put(
+                    cache_key,
+                    question,
+                    self.question_counts.get(qindex, self.encrypted_invalid_votes),
+                    invalid_votes
+                )
+            yield (qindex, question)
+
+        if self.checkpoint is not None:
+            os.remove(self.checkpoint_path)
+
+    def tally_tar(
+        self,
+        tally_path,
+        encrypted_invalid_votes=0,
+        question_indexes=None,
+        withdrawals=None,
+        index_path=None
+    ):
+        '''
+        Tallies the election in the given tar.gz file and returns the results.
+
+        The gzip stream is read once and each plaintexts_json member is tallied
+        as it arrives, without extracting anything to disk. This requires the
+        question_json member to come before the plaintexts. If it does not,
+        the archive is opened again in random access mode.
+
+        If an index_path is given, the tar index stored there (which is built
+        first if it does not exist) is used instead to read only the members
+        of the tallied questions.
+        '''
+        tally_args = dict(
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            question_indexes=question_indexes,
+            withdrawals=withdrawals
+        )
+        if index_path is not None:
+            return self._tally_indexed_tar(tally_path, index_path, tally_args)
+
+        with tarfile.open(
+            tally_path,
+            mode="r|gz",
+            bufsize=self.read_buffer_size
+        ) as tally_gz:
+            started = False
+            question_ids = dict()
+            for member in tally_gz:
+                if member.name == "question_json":
+                    questions = json.loads(
+                        tally_gz.extractfile(member).read().decode('utf-8')
+                    )
+                    self.start(questions=questions, **tally_args)
+                    started = True
+                elif member.name.endswith("/plaintexts_json"):
+                    if not started:
+                        break
+                    self._add_tar_member(
+                        member.name,
+                        lambda: tally_gz.extractfile(member),
+                        question_ids
                     )
 
-            question_index += 1
+        if not started:
+            with tarfile.open(tally_path, mode="r:gz") as tally_gz:
+                questions_f = tally_gz.extractfile("question_json")
+                questions = json.loads(questions_f.read().decode('utf-8'))
+                self.start(questions=questions, **tally_args)
+                question_ids = dict()
+                for member in tally_gz.getmembers():
+                    if member.name.endswith("/plaintexts_json"):
+                        self._add_tar_member(
+                            member.name,
+                            lambda: tally_gz.extractfile(member),
+                            question_ids
+                        )
 
+        return self._finish_tar(question_ids)
 
-    extra_data = dict()
+    def _tally_indexed_tar(self, tally_path, index_path, tally_args):
+        '''
+        Tallies a tar.gz file using its tar index
+        '''
+        index = tar_index.get_index(tally_path, index_path)
+        with tar_index.open_member(
+            tally_path,
+            index,
+            "question_json"
+        ) as questions_f:
+            questions = json.loads(questions_f.read().decode('utf-8'))
+        self.start(questions=questions, **tally_args)
 
-    # post process the tally
-    for qindex, tally in enumerate(tallies):
-        if question_indexes is not None and qindex not in question_indexes:
-            continue
-        tally.post_tally(questions)
+        # only the members of the tallied questions are decompressed
+        plaintexts_names = []
+        for name in index['members']:
+            if not name.endswith("/plaintexts_json"):
+                continue
+            question_dir_index = get_question_dir_index(name)
+            if (
+                question_dir_index is not None and
+                question_dir_index[0] < len(self.questions) and
+                self.is_tallied(question_dir_index[0])
+            ):
+                plaintexts_names.append(name)
 
-    return dict(
-        questions = questions,
-        total_votes = total_count
-    )
+        question_ids = dict()
+        for name, member_file in tar_index.iter_members(
+            tally_path,
+            index,
+            plaintexts_names
+        ):
+            self._add_tar_member(name, lambda: member_file, question_ids)
+
+        return self._finish_tar(question_ids)
+
+    def _finish_tar(self, question_ids):
+        '''
+        Checks that all the tallied questions had plaintexts and finishes the
+        tally
+        '''
+        for qindex in range(len(self.questions)):
+            if self.is_tallied(qindex) and qindex not in question_ids:
+                if not self.allow_empty_tally:
+                    raise IndexError(
+                        "no plaintexts_json found for question %d" % qindex
+                    )
+
+        return self.finish()
+
+    def _add_tar_member(self, name, open_member, question_ids):
+        '''
+        Adds the ballots of a plaintexts_json tar member to the tally of its
+        question, opening it with the given function. question_ids contains
+        the question ids of the questions already added, so that only the
+        first member of each one is used.
+        '''
+        question_dir_index = get_question_dir_index(name)
+        if question_dir_index is None:
+            return
+        qindex, question_id = question_dir_index
+        if (
+            qindex >= len(self.questions) or
+            not self.is_tallied(qindex) or
+            qindex in question_ids
+        ):
+            return
+
+        question_ids[qindex] = question_id
+        self.tallies[qindex].question_id = question_id
+        with open_member() as plaintexts_file:
+            self.add_ballots(qindex, plaintexts_file)
+
+    def tally_iter(
+        self,
+        questions,
+        ballots,
+        encrypted_invalid_votes=0,
+        question_indexes=None,
+        withdrawals=None,
+        histogram=False
+    ):
+        '''
+        Tallies an election from in-memory ballots and returns the results.
+        ballots is a dict whose keys are the question indexes and whose values
+        are iterables of plaintexts, given as ints or as decimal str or bytes.
+        If histogram is True, the values are instead iterables of
+        (plaintext, count) pairs.
+        '''
+        self.start(
+            questions=questions,
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            question_indexes=question_indexes,
+            withdrawals=withdrawals
+        )
+
+        for qindex in range(len(self.questions)):
+            if not self.is_tallied(qindex):
+                continue
+
+            if qindex not in ballots:
+                if not self.allow_empty_tally:
+                    raise KeyError(
+                        "no ballots given for question %d" % qindex
+                    )
+                continue
+
+            if histogram:
+                self.add_ballot_counts(qindex, ballots[qindex], parse_plaintext)
+            else:
+                self.add_ballots(qindex, ballots[qindex], parse_plaintext)
+
+        return self.finish()
+
+def do_tally(
+    dir_path, 
+    questions, 
+    tallies=None, 
+    ignore_invalid_votes=False,
+    encrypted_invalid_votes=0,
+    monkey_patcher=None,
+    question_indexes=None, 
+    withdrawals=None, 
+    allow_empty_tally=False,
+    read_buffer_size=READ_BUFFER_SIZE,
+    dir_index=None,
+    checkpoint_path=None,
+    checkpoint_interval=checkpoint.CHECKPOINT_INTERVAL,
+    invalid_vote_sink=None,
+    cache_dir=None,
+    jobs=None,
+    threads=None
+):
+    '''
+    Tallies the election whose plaintexts are in the given directory and
+    returns the results. If a tallies list is given, the tally objects of
+    each question are appended to it, None for the questions that are not in
+    question_indexes. dir_index can be given to reuse the
+    result of a previous call to index_tally_dir(dir_path). If a
+    checkpoint_path is given, the tally is resumed from it if it exists and
+    checkpoints are saved there while tallying, see TallyEngine.tally().
+    Invalid ballots are reported to invalid_vote_sink if given, see
+    tally_methods.invalid_votes. If a cache_dir is given, the results of each
+    question are cached there, see tally_methods.result_cache.
+
+    If jobs is greater than one, the questions are tallied concurrently by
+    that many worker processes, see tally_methods.parallel.tally_dir(). The
+    results and the invalid ballots reported are the same, but the tally
+    objects live in the workers, so tallies and checkpoints can not be used.
+
+    If threads is greater than one and this Python build runs threads in
+    parallel (it has no global interpreter lock), the file of each question is
+    split into chunks tallied by that many threads, each one with its own tally
+    objects, which are then merged, see tally_methods.parallel.do_chunkedtally().
+    Otherwise the tally is sequential. Threads can not be combined with jobs,
+    tallies, checkpoints or cache_dir.
+    '''
+    # imported here because tally_methods.parallel imports this module
+    from tally_methods import parallel
+
+    if jobs is not None and jobs > 1 and (
+        tallies is not None or
+        checkpoint_path is not None
+    ):
+        raise ValueError("tallies and checkpoints can not be used with jobs")
+    if threads is not None and threads > 1 and (
+        (jobs is not None and jobs > 1) or
+        tallies is not None or
+        checkpoint_path is not None or
+        cache_dir is not None
+    ):
+        raise ValueError(
+            "threads can not be used with jobs, tallies, checkpoints or "
+            "cache_dir"
+        )
+    if threads is not None and threads > 1 and not parallel.is_gil_enabled():
+        return parallel.do_chunkedtally(
+            dir_path=dir_path,
+            questions=questions,
+            ignore_invalid_votes=ignore_invalid_votes,
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            monkey_patcher=monkey_patcher,
+            question_indexes=question_indexes,
+            withdrawals=withdrawals,
+            allow_empty_tally=allow_empty_tally,
+            read_buffer_size=read_buffer_size,
+            dir_index=dir_index,
+            workers=threads,
+            use_threads=True,
+            invalid_vote_sink=invalid_vote_sink
+        )
+
+    with TallyEngine(
+        ignore_invalid_votes=ignore_invalid_votes,
+        monkey_patcher=monkey_patcher,
+        allow_empty_tally=allow_empty_tally,
+        read_buffer_size=read_buffer_size,
+        invalid_vote_sink=invalid_vote_sink
+    ) as engine:
+        if jobs is not None and jobs > 1:
+            return parallel.tally_dir(
+                engine,
+                dir_path=dir_path,
+                questions=questions,
+                encrypted_invalid_votes=encrypted_invalid_votes,
+                question_indexes=question_indexes,
+                withdrawals=withdrawals,
+                dir_index=dir_index,
+                result_cache=(
+                    ResultCache(cache_dir) if cache_dir is not None else None
+                ),
+                workers=jobs
+            )
+
+        results = engine.tally(
+            dir_path=dir_path,
+            questions=questions,
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            question_indexes=question_indexes,
+            withdrawals=withdrawals,
+            dir_index=dir_index,
+            checkpoint_path=checkpoint_path,
+            checkpoint_interval=checkpoint_interval,
+            result_cache=(
+                ResultCache(cache_dir) if cache_dir is not None else None
+            )
+        )
+        if tallies is not None:
+            tallies.extend(engine.tallies)
+        return results
+
+def do_iter_tally(
+    dir_path,
+    questions,
+    ignore_invalid_votes=False,
+    encrypted_invalid_votes=0,
+    monkey_patcher=None,
+    question_indexes=None,
+    withdrawals=None,
+    allow_empty_tally=False,
+    read_buffer_size=READ_BUFFER_SIZE,
+    dir_index=None,
+    invalid_vote_sink=None
+):
+    '''
+    Generator that tallies the election whose plaintexts are in the given
+    directory, yielding a pair with the index and the results of each question
+    as soon as it is tallied, so that they can be published before the rest
+    of the questions are tallied. See TallyEngine.iter_tally().
+    '''
+    with TallyEngine(
+        ignore_invalid_votes=ignore_invalid_votes,
+        monkey_patcher=monkey_patcher,
+        allow_empty_tally=allow_empty_tally,
+        read_buffer_size=read_buffer_size,
+        invalid_vote_sink=invalid_vote_sink
+    ) as engine:
+        for qindex, question in engine.iter_tally(
+            dir_path=dir_path,
+            questions=questions,
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            question_indexes=question_indexes,
+            withdrawals=withdrawals,
+            dir_index=dir_index
+        ):
+            yield (qindex, question)
+
+def tally_iter(
+    questions,
+    ballots,
+    tallies=None,
+    ignore_invalid_votes=False,
+    encrypted_invalid_votes=0,
+    monkey_patcher=None,
+    question_indexes=None,
+    withdrawals=None,
+    allow_empty_tally=False,
+    histogram=False,
+    invalid_vote_sink=None
+):
+    '''
+    Tallies an election from in-memory ballots, without touching the
+    filesystem, and returns the results. ballots is a dict whose keys are the
+    question indexes and whose values are iterables of plaintexts, given as
+    ints or as decimal str or bytes, or of (plaintext, count) pairs if
+    histogram is True. If a tallies list is given, the tally objects of each
+    question are appended to it.
+    '''
+    with TallyEngine(
+        ignore_invalid_votes=ignore_invalid_votes,
+        monkey_patcher=monkey_patcher,
+        allow_empty_tally=allow_empty_tally,
+        invalid_vote_sink=invalid_vote_sink
+    ) as engine:
+        results = engine.tally_iter(
+            questions=questions,
+            ballots=ballots,
+            encrypted_invalid_votes=encrypted_invalid_votes,
+            question_indexes=question_indexes,
+            withdrawals=withdrawals,
+            histogram=histogram
+        )
+        if tallies is not None:
+            tallies.extend(engine.tallies)
+        return results
 
 if __name__ == "__main__":
+    args = sys.argv[1:]
+    compact = "--compact" in args
+    if compact:
+        args.remove("--compact")
     try:
-        tally_path = sys.argv[1]
+        tally_path = args[0]
     except:
-        print("usage: %s <tally_path>" % sys.argv[0])
+        print("usage: %s [--compact] <tally_path>" % sys.argv[0])
         exit(1)
 
     if not os.path.exists(tally_path):
         print("tally path and/or questions_path don't exist")
         exit(1)
     if os.path.isdir(tally_path):
-        print(json.dumps(do_dirtally(tally_path), indent=4))
+        results = do_dirtally(tally_path)
     else:
-        print(json.dumps(do_tartally(tally_path), indent=4))
+        results = do_tartally(tally_path)
+    file_helpers.write_json(results, sys.stdout, compact=compact)
+    sys.stdout.write("\n")
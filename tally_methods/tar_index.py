@@ -0,0 +1,392 @@
+# This file is part of tally-methods.
+# Copyright (C) 2024  Sequent Tech Inc <legal@sequentech.io>
+
+# tally-methods is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License.
+
+# tally-methods  is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Random access to the members of tally tar.gz files.
+
+A gzip file can only be decompressed from the start of one of its gzip
+members, so the index stores as checkpoints the compressed and uncompressed
+offsets of the gzip members, together with the offset and size of each tar
+member. To read a tar member, decompression starts at the last checkpoint
+before it, and iter_members() reads all the wanted members after the same
+checkpoint in one pass.
+
+The index also stores the size, the modification time and the last bytes (the
+CRC and size of the last gzip member) of the tar.gz file it was built from, so
+that an index is never used with a different or regenerated archive.
+
+Most tar.gz files contain a single gzip member, and so a single checkpoint.
+write_indexed_tar() rewrites them starting a new gzip member before each tar
+member and every checkpoint_interval bytes. The result is still a standard
+tar.gz file.
+'''
+
+import io
+import json
+import os
+import tarfile
+import zlib
+from bisect import bisect_right
+
+from tally_methods import file_helpers
+
+INDEX_VERSION = 2
+
+# minimum number of uncompressed bytes between checkpoints
+CHECKPOINT_INTERVAL = 1024 * 1024
+
+# size of the compressed chunks read from the tar.gz file
+CHUNK_SIZE = 64 * 1024
+
+# wbits value used by zlib for gzip streams
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# number of bytes at the end of the archive stored in the index, the CRC32 and
+# size trailer of the last gzip member
+ARCHIVE_TAIL_SIZE = 8
+
+class _GzipMembersReader(io.RawIOBase):
+    '''
+    Reads the decompressed data of a gzip file with any number of gzip members,
+    starting at the given compressed offset, which must be the start of a gzip
+    member. on_member is called with the compressed and uncompressed offsets
+    of the start of each gzip member.
+    '''
+    def __init__(
+        self,
+        raw_file,
+        compressed_offset=0,
+        uncompressed_offset=0,
+        on_member=None
+    ):
+        self.raw_file = raw_file
+        self.raw_file.seek(compressed_offset)
+        self.compressed_offset = compressed_offset
+        self.uncompressed_offset = uncompressed_offset
+        self.on_member = on_member
+        self.pending = b''
+        self.chunk = b''
+        self.decompressor = None
+        self.finished = False
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self.raw_file.close()
+        super().close()
+
+    def _new_member(self):
+        self.decompressor = zlib.decompressobj(GZIP_WBITS)
+        if self.on_member is not None:
+            self.on_member(self.compressed_offset, self.uncompressed_offset)
+
+    def _read_chunk(self):
+        '''
+        Returns the next chunk of decompressed data, or b'' at the end
+        '''
+        while not self.finished:
+            data = self.pending or self.raw_file.read(CHUNK_SIZE)
+            self.pending = b''
+            if len(data) == 0 or (
+                self.decompressor is None and data.strip(b'\0') == b''
+            ):
+                # end of file, possibly with some zero padding
+                self.finished = True
+                break
+
+            if self.decompressor is None:
+                self._new_member()
+            chunk = self.decompressor.decompress(data)
+            consumed = len(data)
+            if self.decompressor.eof:
+                self.pending = self.decompressor.unused_data
+                consumed -= len(self.pending)
+                self.decompressor = None
+            self.compressed_offset += consumed
+            self.uncompressed_offset += len(chunk)
+            if len(chunk) > 0:
+                return chunk
+        return b''
+
+    def readinto(self, buffer):
+        if len(self.chunk) == 0:
+            self.chunk = self._read_chunk()
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+class _MemberReader(io.RawIOBase):
+    '''
+    Reads size bytes from a decompressed stream, after skipping skip bytes.
+    The stream is closed with the reader unless close_stream is False.
+    '''
+    def __init__(self, stream, skip, size, close_stream=True):
+        self.stream = stream
+        self.skip = skip
+        self.remaining = size
+        self.close_stream = close_stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.skip > 0:
+            skipped = len(self.stream.read(min(self.skip, CHUNK_SIZE)))
+            if skipped == 0:
+                raise EOFError("unexpected end of the tar.gz file")
+            self.skip -= skipped
+
+        size = min(len(buffer), self.remaining)
+        if size == 0:
+            return 0
+        data = self.stream.read(size)
+        if len(data) == 0:
+            raise EOFError("unexpected end of the tar.gz file")
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        if self.close_stream:
+            self.stream.close()
+        super().close()
+
+def get_archive_info(tally_path):
+    '''
+    Returns the size, modification time and last bytes of the given tar.gz
+    file, which identify the version of the archive an index was built from
+    '''
+    stat = os.stat(tally_path)
+    with open(tally_path, mode='rb') as raw_file:
+        raw_file.seek(max(stat.st_size - ARCHIVE_TAIL_SIZE, 0))
+        tail = raw_file.read(ARCHIVE_TAIL_SIZE)
+    return dict(
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        tail=tail.hex()
+    )
+
+def build_index(tally_path, checkpoint_interval=CHECKPOINT_INTERVAL):
+    '''
+    Reads the given tar.gz file once and returns its index
+    '''
+    checkpoints = []
+
+    def on_member(compressed_offset, uncompressed_offset):
+        if (
+            len(checkpoints) == 0 or
+            uncompressed_offset - checkpoints[-1][1] >= checkpoint_interval
+        ):
+            checkpoints.append([compressed_offset, uncompressed_offset])
+
+    archive = get_archive_info(tally_path)
+    members = dict()
+    with open(tally_path, mode='rb') as raw_file:
+        reader = _GzipMembersReader(raw_file, on_member=on_member)
+        with tarfile.open(fileobj=reader, mode='r|') as tally_tar:
+            for member in tally_tar:
+                if member.isfile():
+                    members[member.name] = [member.offset_data, member.size]
+
+    return dict(
+        version=INDEX_VERSION,
+        archive=archive,
+        checkpoint_interval=checkpoint_interval,
+        checkpoints=checkpoints,
+        members=members
+    )
+
+def write_index(index, index_path):
+    file_helpers.write_json_file(index_path, index)
+
+def read_index(index_path, tally_path=None):
+    '''
+    Reads an index. If a tally_path is given, it checks that the index was
+    built from that tar.gz file as it is now.
+    '''
+    index = json.loads(file_helpers.read_file(index_path))
+    if index.get('version') != INDEX_VERSION:
+        raise Exception(
+            "unsupported tar index version %r" % index.get('version')
+        )
+    if (
+        tally_path is not None and
+        index['archive'] != get_archive_info(tally_path)
+    ):
+        raise Exception(
+            "the tar index %s was built from a different version of %s" % (
+                index_path,
+                tally_path
+            )
+        )
+    return index
+
+def get_index(
+    tally_path,
+    index_path,
+    checkpoint_interval=CHECKPOINT_INTERVAL
+):
+    '''
+    Returns the index of the given tar.gz file, reading it from index_path. If
+    it does not exist yet, or it was built from a different version of the
+    tar.gz file or by a different version of this module, it is built and
+    written there.
+    '''
+    if os.path.exists(index_path):
+        index = json.loads(file_helpers.read_file(index_path))
+        if (
+            index.get('version') == INDEX_VERSION and
+            index['archive'] == get_archive_info(tally_path)
+        ):
+            return index
+
+    index = build_index(tally_path, checkpoint_interval)
+    write_index(index, index_path)
+    return index
+
+def open_member(tally_path, index, name):
+    '''
+    Returns a binary file object with the data of the given tar member.
+    Decompression starts at the last checkpoint before the member, and each
+    call opens its own file handle, so that different members can be read in
+    parallel.
+    '''
+    offset, size = index['members'][name]
+    compressed_offset, uncompressed_offset = index['checkpoints'][
+        _get_checkpoint_index(index, offset)
+    ]
+    stream = _open_stream(tally_path, compressed_offset, uncompressed_offset)
+    return io.BufferedReader(
+        _MemberReader(stream, offset - uncompressed_offset, size)
+    )
+
+def iter_members(tally_path, index, names):
+    '''
+    Generator that yields a (name, file object) pair for each of the given tar
+    members, in the order they have in the archive. The members after the same
+    checkpoint are read in a single decompression pass that starts there, so
+    no data is decompressed twice, even in tar.gz files with a single
+    checkpoint. The members after different checkpoints are independent, and
+    can also be read in parallel with open_member().
+
+    Each file object can only be read until the next pair is requested.
+    '''
+    groups = dict()
+    for name in sorted(names, key=lambda name: index['members'][name][0]):
+        offset = index['members'][name][0]
+        groups.setdefault(_get_checkpoint_index(index, offset), []).append(name)
+
+    for checkpoint_index in sorted(groups):
+        compressed_offset, position = index['checkpoints'][checkpoint_index]
+        with _open_stream(tally_path, compressed_offset, position) as stream:
+            for name in groups[checkpoint_index]:
+                offset, size = index['members'][name]
+                member_reader = _MemberReader(
+                    stream,
+                    offset - position,
+                    size,
+                    close_stream=False
+                )
+                with io.BufferedReader(member_reader) as member_file:
+                    yield (name, member_file)
+                # the part of the member that was not read is skipped with
+                # the next one
+                position = offset + size - member_reader.remaining
+                if member_reader.skip > 0:
+                    position = offset - member_reader.skip
+
+def _get_checkpoint_index(index, offset):
+    '''
+    Returns the index of the last checkpoint before the given uncompressed
+    offset
+    '''
+    uncompressed_offsets = [checkpoint[1] for checkpoint in index['checkpoints']]
+    return bisect_right(uncompressed_offsets, offset) - 1
+
+def _open_stream(tally_path, compressed_offset, uncompressed_offset):
+    return io.BufferedReader(_GzipMembersReader(
+        open(tally_path, mode='rb'),
+        compressed_offset=compressed_offset,
+        uncompressed_offset=uncompressed_offset
+    ))
+
+class _MultiMemberGzipWriter(object):
+    '''
+    Writes a gzip file that starts a new gzip member when new_member() is
+    called and every checkpoint_interval bytes
+    '''
+    def __init__(self, raw_file, checkpoint_interval):
+        self.raw_file = raw_file
+        self.checkpoint_interval = checkpoint_interval
+        self.compressor = None
+        self.offset = 0
+        self.member_size = 0
+
+    def tell(self):
+        return self.offset
+
+    def new_member(self):
+        if self.compressor is not None:
+            self.raw_file.write(self.compressor.flush())
+        self.compressor = zlib.compressobj(9, zlib.DEFLATED, GZIP_WBITS)
+        self.member_size = 0
+
+    def write(self, data):
+        data = memoryview(data)
+        while len(data) > 0:
+            if (
+                self.compressor is None or
+                self.member_size >= self.checkpoint_interval
+            ):
+                self.new_member()
+            size = min(
+                len(data),
+                self.checkpoint_interval - self.member_size
+            )
+            self.raw_file.write(self.compressor.compress(data[:size]))
+            self.member_size += size
+            self.offset += size
+            data = data[size:]
+
+    def close(self):
+        if self.compressor is not None:
+            self.raw_file.write(self.compressor.flush())
+            self.compressor = None
+
+def write_indexed_tar(
+    src_path,
+    dst_path,
+    checkpoint_interval=CHECKPOINT_INTERVAL
+):
+    '''
+    Copies the src_path tar.gz file into dst_path, starting a new gzip member
+    before each tar member and every checkpoint_interval bytes, and returns
+    its index
+    '''
+    with open(dst_path, mode='wb') as raw_file:
+        writer = _MultiMemberGzipWriter(raw_file, checkpoint_interval)
+        with tarfile.open(src_path, mode='r|gz') as src_tar, \
+            tarfile.open(fileobj=writer, mode='w') as dst_tar:
+            for member in src_tar:
+                writer.new_member()
+                if member.isfile():
+                    dst_tar.addfile(member, src_tar.extractfile(member))
+                else:
+                    dst_tar.addfile(member)
+        writer.close()
+
+    return build_index(dst_path, checkpoint_interval)
@@ -15,7 +15,6 @@
 
 from importlib import import_module
 from collections import defaultdict
-import copy
 from tally_methods.ballot_codec.sequent_codec import NVotesCodec
 
 VOTING_METHODS = (
@@ -87,6 +86,32 @@ class WeightedChoice:
     def __repr__(self):
         return self.__str__()
 
+class VoteRecord(object):
+    '''
+    Represents the vote of a voter to the question being tallied, as given to
+    BaseTally.add_vote(). choices is None unless the vote is valid, in which
+    case it contains the choices returned by BaseTally.parse_vote(). count is
+    the number of identical ballots represented by this vote.
+    '''
+    __slots__ = ('choices', 'is_blank', 'is_null', 'count')
+
+    def __init__(self, choices=None, is_blank=False, is_null=False, count=1):
+        self.choices = choices
+        self.is_blank = is_blank
+        self.is_null = is_null
+        self.count = count
+
+    def __str__(self):
+        return "VoteRecord(choices=%(choices)r, is_blank=%(is_blank)r, is_null=%(is_null)r, count=%(count)r)" % dict(
+            choices=self.choices,
+            is_blank=self.is_blank,
+            is_null=self.is_null,
+            count=self.count
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
 class BaseVotingSystem(object):
     '''
     Defines the helper functions that allows sequent to manage a voting system.
@@ -115,6 +140,21 @@ class BaseVotingSystem(object):
         return BaseTally(election, question_num)
 
 
+def copy_question(question):
+    '''
+    Returns a copy of a question for it to be tallied. Tallies only modify
+    the question dict, its answers and its totals, so only these are copied,
+    and the rest of the question definition is shared with the original.
+    '''
+    copied_question = dict(question)
+    copied_question['answers'] = [
+        dict(answer)
+        for answer in question['answers']
+    ]
+    if 'totals' in question:
+        copied_question['totals'] = dict(question['totals'])
+    return copied_question
+
 def get_key(answer):
     '''
     If it's a write-in, returns the text of the write-in. Else,
@@ -126,6 +166,17 @@ def get_key(answer):
         return answer['id']
 
 
+def _merge_answer_counts(answer, other_answer):
+    '''
+    Adds the counts of other_answer to those of answer
+    '''
+    answer['total_count'] += other_answer['total_count']
+    if 'voters_by_position' in other_answer:
+        voters_by_position = answer['voters_by_position']
+        for position, voters in enumerate(other_answer['voters_by_position']):
+            voters_by_position[position] += voters
+
+
 class BaseTally(object):
     '''
     Class oser to tally an election
@@ -158,7 +209,7 @@ class BaseTally(object):
         # these are the answers that are not write-ins, so we can directly count
         # them
         self.normal_answers = dict([
-            (answer['id'], copy.deepcopy(answer))
+            (answer['id'], dict(answer))
             for answer in question['answers']
             if dict(title='isWriteIn', url='true') not in answer.get('urls', [])
         ])
@@ -271,28 +322,40 @@ class BaseTally(object):
         elif exception == 'implicit':
             raise ImplicitInvalidVoteException(non_blank_unwithdrawed_answers)
 
+    def get_vote(self, voter_answers):
+        '''
+        Returns the VoteRecord of this question. voter_answers is usually a
+        VoteRecord, but the legacy format (a list with one dict per question
+        with the choices, is_blank and is_null keys) is also accepted.
+        '''
+        if isinstance(voter_answers, VoteRecord):
+            return voter_answers
+
+        voter_answer = voter_answers[self.question_num]
+        return VoteRecord(
+            choices=voter_answer['choices'],
+            is_blank=voter_answer.get('is_blank', False),
+            is_null=voter_answer.get('is_null', False)
+        )
+
     def add_vote(self, voter_answers, questions, is_delegated):
         '''
         Add to the count a vote from a voter
         '''
         question = questions[self.question_num]
-        choices = voter_answers[self.question_num]['choices']
-        if (
-            not voter_answers[self.question_num]['is_blank'] and 
-            not voter_answers[self.question_num]['is_null']
-        ):
-            question['totals']['valid_votes'] += 1
-            for choice in choices:
+        vote = self.get_vote(voter_answers)
+        if not vote.is_blank and not vote.is_null:
+            question['totals']['valid_votes'] += vote.count
+            for choice in vote.choices:
                 if isinstance(choice.key, str):
-                    if choice.key in self.write_in_answers:
-                        self.write_in_answers[choice.key]['total_count'] += choice.points
-                    else:
-                        self.write_in_answers[choice.key] = dict(
+                    answer = self.write_in_answers.get(choice.key)
+                    if answer is None:
+                        answer = self.write_in_answers[choice.key] = dict(
                             id=None, # this will be set later
                             text=choice.key,
                             category="",
                             details="",
-                            total_count=choice.points,
+                            total_count=0,
                             winner_position=None,
                             urls=[
                                 dict(title='isWriteInResult', url='true')
@@ -301,7 +364,80 @@ class BaseTally(object):
                 else:
                     # we can safely assume that the id is valid, as otherwise
                     # this would be counted as an invalid vote
-                    self.normal_answers[choice.answer_id]['total_count'] += choice.points
+                    answer = self.normal_answers[choice.answer_id]
+                self.add_points(answer, choice.points, vote.count)
+
+    def add_points(self, answer, points, count):
+        '''
+        Adds to the total count of an answer the points given by count
+        identical ballots. Float points are added one ballot at a time, as
+        multiplying them by the count can round differently than adding them
+        count times, see is_merge_exact().
+        '''
+        if count == 1:
+            answer['total_count'] += points
+        elif self.is_merge_exact():
+            answer['total_count'] += points * count
+        else:
+            total_count = answer['total_count']
+            for _ in range(count):
+                total_count += points
+            answer['total_count'] = total_count
+
+    def get_state(self):
+        '''
+        Returns the counts added so far as a JSON serializable dict, which can
+        be restored with set_state() after pre_tally()
+        '''
+        return dict(
+            normal_answers=[
+                [answer_id, answer]
+                for answer_id, answer in self.normal_answers.items()
+            ],
+            write_in_answers=[
+                [key, answer]
+                for key, answer in self.write_in_answers.items()
+            ]
+        )
+
+    def set_state(self, state):
+        '''
+        Restores the counts returned by get_state()
+        '''
+        self.normal_answers = dict([
+            (answer_id, answer)
+            for answer_id, answer in state['normal_answers']
+        ])
+        self.write_in_answers = dict([
+            (key, answer)
+            for key, answer in state['write_in_answers']
+        ])
+
+    def merge_state(self, state):
+        '''
+        Adds the counts of a state returned by get_state() by another tally
+        object of the same question, for example one that counted a different
+        part of its ballots in another process
+        '''
+        for answer_id, answer in state['normal_answers']:
+            _merge_answer_counts(self.normal_answers[answer_id], answer)
+        for key, answer in state['write_in_answers']:
+            if key in self.write_in_answers:
+                _merge_answer_counts(self.write_in_answers[key], answer)
+            else:
+                self.write_in_answers[key] = dict(answer)
+                if 'voters_by_position' in answer:
+                    self.write_in_answers[key]['voters_by_position'] = \
+                        answer['voters_by_position'][:]
+
+    def is_merge_exact(self):
+        '''
+        Returns True if merging the states of tally objects that counted parts
+        of the ballots gives exactly the same counts as counting all of them in
+        the same tally object. This is not the case when points are floats,
+        as float additions done in a different order can round differently.
+        '''
+        return True
 
     def post_tally(self, questions):
         '''
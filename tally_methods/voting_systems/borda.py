@@ -116,17 +116,14 @@ class BordaTally(BaseTally):
         '''
         super().add_vote(voter_answers, questions, is_delegated)
 
-        if (
-            voter_answers[self.question_num]['is_blank'] or
-            voter_answers[self.question_num]['is_null']
-        ):
+        vote = self.get_vote(voter_answers)
+        if vote.is_blank or vote.is_null:
             return
         
         # count voters by position
         question = questions[self.question_num]
-        choices = voter_answers[self.question_num]['choices']
         choices = sorted(
-            list(choices),
+            list(vote.choices),
             key=lambda choice: choice.points,
             reverse=True
         )
@@ -141,4 +138,4 @@ class BordaTally(BaseTally):
                     answer['voters_by_position'] = [0] * question['max']
             else:
                 answer = self.normal_answers[choice.key]
-            answer['voters_by_position'][choice_index] += 1
+            answer['voters_by_position'][choice_index] += vote.count
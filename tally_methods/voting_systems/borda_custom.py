@@ -95,3 +95,9 @@ class BordaCustomTally(BordaTally):
                 raise ImplicitInvalidVoteException(ret_value)
 
         self.custom_subparser = custom_subparser
+
+    def is_merge_exact(self):
+        return all(
+            isinstance(weight, int)
+            for weight in self.question['borda_custom_weights']
+        )
@@ -91,3 +91,7 @@ class BordaNauruTally(BordaTally):
                 raise ImplicitInvalidVoteException(ret_value)
 
         self.custom_subparser = custom_subparser
+
+    def is_merge_exact(self):
+        # points are fractions of one
+        return False
@@ -13,7 +13,6 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with tally-methods.  If not, see <http://www.gnu.org/licenses/>.
 
-import copy
 from operator import itemgetter
 
 from .base import (
@@ -82,7 +81,7 @@ class DesbordaTally(BaseTally):
         def custom_subparser(decoded_ballot, question, withdrawals):
             answers = set()
 
-            sorted_ballot_answers = copy.deepcopy(decoded_ballot['answers'])
+            sorted_ballot_answers = decoded_ballot['answers'][:]
             sorted_ballot_answers.sort(key=itemgetter('selected'))
             filtered_ballot_answers = [
                 answer
@@ -124,17 +123,14 @@ class DesbordaTally(BaseTally):
         '''
         super().add_vote(voter_answers, questions, is_delegated)
 
-        if (
-            voter_answers[self.question_num]['is_blank'] or
-            voter_answers[self.question_num]['is_null']
-        ):
+        vote = self.get_vote(voter_answers)
+        if vote.is_blank or vote.is_null:
             return
 
         # count voters by position
         question = questions[self.question_num]
-        choices = voter_answers[self.question_num]['choices']
         choices = sorted(
-            list(choices),
+            list(vote.choices),
             key=lambda choice: choice.points,
             reverse=True
         )
@@ -149,7 +145,7 @@ class DesbordaTally(BaseTally):
                     answer['voters_by_position'] = [0] * question['max']
             else:
                 answer = self.normal_answers[choice.key]
-            answer['voters_by_position'][choice_index] += 1
+            answer['voters_by_position'][choice_index] += vote.count
 
     def post_tally(self, questions):
         super().post_tally(questions)
@@ -1,21 +1,131 @@
+import asyncio
+import bz2
+import collections
+import gzip
+import io
+import lzma
 import random
+import shutil
+import subprocess
+import sys
 import unittest
+import unittest.mock
 import codecs
 import os
 import copy
 import json
-import six
+import tarfile
+import tempfile
+import tracemalloc
+import zipfile
 from operator import itemgetter
 
-from tally_methods.tally import do_tartally, do_dirtally, do_tally
+from tally_methods.tally import (
+    do_tartally,
+    do_dirtally,
+    do_tally,
+    do_iter_tally,
+    tally_iter,
+    TallyEngine
+)
 from tally_methods.voting_systems.plurality_at_large import PluralityAtLarge
+from tally_methods.voting_systems.borda import Borda
+from tally_methods.voting_systems.base import VoteRecord
 from tally_methods import file_helpers
+from tally_methods import tar_index, ballot_file, checkpoint
+from tally_methods.async_tally import tally_stream
+from tally_methods.follow import TallyFollower, do_followtally
+from tally_methods.invalid_votes import (
+    FileInvalidVoteSink,
+    RecordingInvalidVoteSink
+)
+from tally_methods.parallel import do_chunkedtally, do_ziptally
+from tally_methods.plaintexts import (
+    BALLOT_FILE_NAME,
+    index_tally_dir,
+    parse_plaintext
+)
+from tally_methods.shard import do_mergetally, do_shardtally
 from tally_methods.ballot_codec.mixed_radix import TestMixedRadix
 from tally_methods.ballot_codec.sequent_codec import TestNVotesCodec
+from tally_methods.ballot_codec.int_parser import TestIntParser
+from tally_methods.ballot_codec.sequent_codec import NVotesCodec
 
 import test.desborda_test
 import test.desborda_test_data
 
+FIXTURES_PATH = os.path.join("test", "fixtures")
+
+def get_fixture_path(dirname, *names):
+    '''
+    Returns the path of the given fixture tally directory, or of a file in it
+    '''
+    return os.path.join(FIXTURES_PATH, dirname, *names)
+
+def read_fixture_questions(dirname):
+    return json.loads(file_helpers.read_file(
+        get_fixture_path(dirname, "questions_json")
+    ))
+
+def read_fixture_results(dirname):
+    return file_helpers.read_file(get_fixture_path(dirname, "results_json"))
+
+def iter_fixture_plaintexts(dirname):
+    '''
+    Yields the name of each question directory of the given fixture and the
+    path of its plaintexts_json file
+    '''
+    fixture_path = get_fixture_path(dirname)
+    for name in sorted(os.listdir(fixture_path)):
+        plaintexts_path = os.path.join(fixture_path, name, "plaintexts_json")
+        if os.path.exists(plaintexts_path):
+            yield (name, plaintexts_path)
+
+def read_fixture_ballots(dirname):
+    '''
+    Returns a dict with the contents of the plaintexts_json file of each
+    question of the given fixture
+    '''
+    ballots = dict()
+    for name, plaintexts_path in iter_fixture_plaintexts(dirname):
+        with open(plaintexts_path, mode='rb') as plaintexts_file:
+            ballots[int(name.split("-")[0])] = plaintexts_file.read()
+    return ballots
+
+def write_fixture_plaintexts(
+    dirname,
+    tally_path,
+    convert=None,
+    file_name="plaintexts_json"
+):
+    '''
+    Writes the plaintexts_json file of each question of the given fixture to
+    a question directory of tally_path with the given file name, converting
+    its contents with the given function if any
+    '''
+    for name, plaintexts_path in iter_fixture_plaintexts(dirname):
+        with open(plaintexts_path, mode='rb') as plaintexts_file:
+            data = plaintexts_file.read()
+        if convert is not None:
+            data = convert(data)
+        os.mkdir(os.path.join(tally_path, name))
+        with open(
+            os.path.join(tally_path, name, file_name),
+            mode='wb'
+        ) as plaintexts_file:
+            plaintexts_file.write(data)
+
+class FixtureMixin(object):
+    def assertFixtureResults(self, results, dirname):
+        '''
+        Checks that the given results are the results_json of the given
+        fixture
+        '''
+        self.assertEqual(
+            file_helpers.serialize(results).strip(),
+            read_fixture_results(dirname).strip()
+        )
+
 def _pretty_print_base(data, mark_winners, show_percent, filter_name):
     '''
     percent_base:
@@ -68,8 +178,7 @@ def _pretty_print_base(data, mark_winners, show_percent, filter_name):
                 get_percentage(answer['total_count'], base_num)))
     print("")
 
-class TestSequenceFunctions(unittest.TestCase):
-    FIXTURES_PATH = os.path.join("test", "fixtures")
+class TestSequenceFunctions(FixtureMixin, unittest.TestCase):
     PLURALITY_AT_LARGE = "plurality-at-large"
     CUMULATIVE = "cumulative"
     CUMULATIVE2 = "cumulative2"
@@ -81,24 +190,13 @@ class TestSequenceFunctions(unittest.TestCase):
     BORDA_CUSTOM = "borda-custom"
     maxDiff = None
 
-    def setUp(self):
-        # http://effbot.org/zone/default-values.htm
-        six.get_function_defaults(do_tally)[0][:] = []
-        pass
-
 
     def _test_method(self, dirname):
         '''
         Generic method to do a tally
         '''
-        tally_path = os.path.join(self.FIXTURES_PATH, dirname)
-        results_path = os.path.join(tally_path, "results_json")
-        results = do_dirtally(tally_path)
-        should_results = file_helpers.read_file(results_path)
-        self.assertEqual(
-            file_helpers.serialize(results).strip(), 
-            should_results.strip()
-        )
+        results = do_dirtally(get_fixture_path(dirname))
+        self.assertFixtureResults(results, dirname)
         return results
 
     def test_borda_nauru(self):
@@ -125,13 +223,1488 @@ class TestSequenceFunctions(unittest.TestCase):
     def test_custom(self):
         self._test_method(self.BORDA_CUSTOM)
 
-class TestDesborda(unittest.TestCase):
+class TestWriteJson(unittest.TestCase):
+    def _write_json(self, data, compact=False):
+        out = io.StringIO()
+        file_helpers.write_json(data, out, compact=compact)
+        return out.getvalue()
+
+    def test_same_as_serialize(self):
+        for dirname in ["borda", "cumulative2", "plurality-at-large"]:
+            results = do_dirtally(get_fixture_path(dirname))
+            self.assertEqual(
+                self._write_json(results),
+                file_helpers.serialize(results)
+            )
 
+    def test_compact(self):
+        data = dict(
+            questions=[
+                dict(answers=[], text="Ñandú\n", urls=[{}]),
+                dict(answers=[dict(id=1, total_count=1.5)], text="b")
+            ],
+            total_votes=2
+        )
+        self.assertEqual(self._write_json(data), file_helpers.serialize(data))
+        self.assertEqual(
+            self._write_json(data, compact=True),
+            json.dumps(
+                data,
+                ensure_ascii=False,
+                sort_keys=True,
+                separators=(',', ':')
+            )
+        )
+
+class TestStreamingIngestion(unittest.TestCase):
     def setUp(self):
-        # http://effbot.org/zone/default-values.htm
-        six.get_function_defaults(do_tally)[0][:] = []
+        self.questions = read_fixture_questions("plurality-at-large")
+        self.tally_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tally_path, "0-question"))
+
+    def tearDown(self):
+        file_helpers.remove_tree(self.tally_path)
+
+    def _write_ballots(self, num_ballots):
+        plaintexts_path = os.path.join(
+            self.tally_path, "0-question", "plaintexts_json"
+        )
+        with open(plaintexts_path, mode='w') as plaintexts_file:
+            for index in range(num_ballots):
+                plaintexts_file.write('"%d"\n' % [7, 13, 3, 5][index % 4])
+
+    def _peak_memory(self, num_ballots):
+        self._write_ballots(num_ballots)
+        tracemalloc.start()
+        try:
+            results = do_tally(
+                self.tally_path,
+                self.questions,
+                tallies=[],
+                read_buffer_size=4096
+            )
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(results['total_votes'], num_ballots)
+        return peak
+
+    def test_flat_memory(self):
+        # warm up, so that lazy imports and caches are not measured
+        self._peak_memory(10)
+        small_peak = self._peak_memory(500)
+        large_peak = self._peak_memory(5000)
+        self.assertLess(large_peak, 2 * small_peak + 16 * 1024)
+
+    def test_read_buffer_size(self):
+        self._write_ballots(100)
+        results = do_tally(self.tally_path, self.questions, tallies=[])
+        results_small_buffer = do_tally(
+            self.tally_path,
+            self.questions,
+            tallies=[],
+            read_buffer_size=16
+        )
+        self.assertEqual(results, results_small_buffer)
+
+class TestTallyEngine(FixtureMixin, unittest.TestCase):
+    def test_reuse(self):
+        with TallyEngine() as engine:
+            for dirname in ["borda", "cumulative", "borda"]:
+                questions = read_fixture_questions(dirname)
+                results = engine.tally(get_fixture_path(dirname), questions)
+                self.assertEqual(len(engine.tallies), len(questions))
+                self.assertFixtureResults(results, dirname)
+        self.assertEqual(engine.tallies, [])
+        self.assertIsNone(engine.questions)
+
+    def test_questions_not_modified(self):
+        for dirname in ["borda", "cumulative2"]:
+            questions = read_fixture_questions(dirname)
+            original_questions = copy.deepcopy(questions)
+            results = do_tally(
+                get_fixture_path(dirname),
+                questions,
+                ignore_invalid_votes=True
+            )
+            self.assertEqual(questions, original_questions)
+            self.assertFixtureResults(results, dirname)
+
+    def test_iter_tally(self):
+        tally_path = get_fixture_path("cumulative2")
+        questions = read_fixture_questions("cumulative2")
+        results = json.loads(read_fixture_results("cumulative2"))
+        yielded = []
+        for qindex, question in do_iter_tally(tally_path, questions):
+            yielded.append(qindex)
+            self.assertEqual(question, results['questions'][qindex])
+        self.assertEqual(yielded, [0, 1])
+
+        with TallyEngine() as engine:
+            question_results = engine.iter_tally(tally_path, questions)
+            self.assertEqual(next(question_results)[0], 0)
+            # the next question is only read when its results are requested
+            self.assertEqual(list(engine.question_counts.keys()), [0])
+            self.assertEqual(next(question_results)[0], 1)
+            self.assertRaises(StopIteration, next, question_results)
+            self.assertFixtureResults(engine.finish(), "cumulative2")
+
+    def test_do_tally_tallies(self):
+        tally_path = get_fixture_path("borda")
+        questions = read_fixture_questions("borda")
+        tallies = []
+        do_tally(tally_path, questions, tallies=tallies)
+        do_tally(tally_path, questions)
+        self.assertEqual(len(tallies), len(questions))
+
+    def test_start_question_indexes(self):
+        # only the tally objects of the tallied questions are created, so that
+        # the workers of a parallel tally do not create one per question
+        tally_path = get_fixture_path("cumulative2")
+        questions = read_fixture_questions("cumulative2")
+        results = json.loads(read_fixture_results("cumulative2"))
+        with TallyEngine() as engine:
+            engine.start(questions, question_indexes=[1])
+            self.assertIsNone(engine.tallies[0])
+            self.assertIsNotNone(engine.tallies[1])
+            engine.add_ballots_file(
+                1,
+                os.path.join(tally_path, "1-question", "plaintexts_json")
+            )
+            self.assertEqual(
+                engine.snapshot()['questions'][1],
+                results['questions'][1]
+            )
+            self.assertEqual(
+                engine.finish()['questions'][1],
+                results['questions'][1]
+            )
+
+class TestDirIndex(unittest.TestCase):
+    def test_index(self):
+        tally_path = get_fixture_path("cumulative2")
+        dir_index = index_tally_dir(tally_path)
+        self.assertEqual(
+            dir_index,
+            {
+                0: (
+                    "0-question",
+                    os.path.join(tally_path, "0-question", "plaintexts_json")
+                ),
+                1: (
+                    "1-question",
+                    os.path.join(tally_path, "1-question", "plaintexts_json")
+                )
+            }
+        )
+
+        # a prebuilt index is used without scanning the directory again
+        questions = read_fixture_questions("cumulative2")
+        results = do_tally(
+            get_fixture_path("non-existent"),
+            questions,
+            ignore_invalid_votes=True,
+            dir_index=dir_index
+        )
+        self.assertEqual(results, do_dirtally(tally_path, ignore_invalid_votes=True))
+
+class TestTallyIter(FixtureMixin, unittest.TestCase):
+    def _test_method(self, dirname, convert):
+        ballots = dict(
+            (qindex, [convert(line) for line in data.splitlines(True)])
+            for qindex, data in read_fixture_ballots(dirname).items()
+        )
+        results = tally_iter(
+            read_fixture_questions(dirname),
+            ballots,
+            ignore_invalid_votes=True
+        )
+        self.assertFixtureResults(results, dirname)
+
+    def _to_int(self, line):
+        try:
+            return int(line.strip().strip(b'"'))
+        except ValueError:
+            return line
+
+    def test_bytes(self):
+        self._test_method("cumulative2", lambda line: line)
+
+    def test_str(self):
+        self._test_method("borda", lambda line: line.decode('utf-8'))
+
+    def test_int(self):
+        self._test_method("borda", self._to_int)
+        self._test_method("plurality-at-large", self._to_int)
+
+class TestHistogram(FixtureMixin, unittest.TestCase):
+    def setUp(self):
+        self.tally_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        file_helpers.remove_tree(self.tally_path)
+
+    def _read_histograms(self, dirname):
+        histograms = dict()
+        for name, plaintexts_path in iter_fixture_plaintexts(dirname):
+            with open(plaintexts_path, mode='rb') as plaintexts_file:
+                histograms[name] = collections.Counter(
+                    line.strip()
+                    for line in plaintexts_file
+                )
+        return histograms
+
+    def _test_method(self, dirname):
+        questions = read_fixture_questions(dirname)
+        histograms = self._read_histograms(dirname)
+
+        ballots = dict(
+            (int(name.split("-")[0]), list(histogram.items()))
+            for name, histogram in histograms.items()
+        )
+        results = tally_iter(
+            questions,
+            ballots,
+            ignore_invalid_votes=True,
+            histogram=True
+        )
+        self.assertFixtureResults(results, dirname)
+
+        for name, histogram in histograms.items():
+            os.mkdir(os.path.join(self.tally_path, name))
+            file_helpers.write_file(
+                os.path.join(self.tally_path, name, "plaintexts_histogram_json"),
+                "".join(
+                    "%s,%d\n" % (plaintext.decode('utf-8'), count)
+                    for plaintext, count in histogram.items()
+                )
+            )
+        results = do_tally(self.tally_path, questions, ignore_invalid_votes=True)
+        self.assertFixtureResults(results, dirname)
+
+    def test_borda(self):
+        self._test_method("borda")
+
+    def test_cumulative2(self):
+        self._test_method("cumulative2")
+
+    def test_plurality_at_large(self):
+        self._test_method("plurality-at-large")
+
+    def test_borda_nauru(self):
+        self._test_method("borda-nauru")
+
+    def test_borda_custom(self):
+        self._test_method("borda-custom")
+
+    def test_float_points(self):
+        # a ballot ranking the three answers gives 1/3 points to the last one,
+        # and 1/3 added six times is not 6 * (1/3)
+        questions = read_fixture_questions("borda-nauru")
+        questions[0]['max'] = 3
+        line = '"115"'
+        should_results = tally_iter(
+            questions,
+            {0: [line] * 6},
+            ignore_invalid_votes=True
+        )
+        results = tally_iter(
+            questions,
+            {0: [(line, 6)]},
+            ignore_invalid_votes=True,
+            histogram=True
+        )
+        self.assertEqual(
+            file_helpers.serialize(results),
+            file_helpers.serialize(should_results)
+        )
+
+    def test_invalid_counts(self):
+        questions = read_fixture_questions("borda")
+        os.mkdir(os.path.join(self.tally_path, "0-question"))
+        file_helpers.write_file(
+            os.path.join(self.tally_path, "0-question", "plaintexts_histogram_json"),
+            '"15",0\n"15",-3\n"15",x\n"15"\n'
+        )
+        results = do_tally(self.tally_path, questions, ignore_invalid_votes=True)
+        self.assertEqual(results['total_votes'], 4)
+        self.assertEqual(results['questions'][0]['totals']['null_votes'], 3)
+        self.assertEqual(results['questions'][0]['totals']['valid_votes'], 1)
+
+        for count in [0, -3]:
+            with TallyEngine(ignore_invalid_votes=True) as engine:
+                engine.start(questions)
+                with self.assertRaises(ValueError):
+                    engine.add_ballot_counts(0, [('"15"', 2), ('"15"', count)])
+                self.assertNotIn(0, engine.question_counts)
+            with self.assertRaises(ValueError):
+                tally_iter(
+                    questions,
+                    {0: [('"15"', count)]},
+                    ignore_invalid_votes=True,
+                    histogram=True
+                )
+
+class TestTallyStream(FixtureMixin, unittest.TestCase):
+
+    async def _feed(self, reader, data, chunk_size):
+        for index in range(0, len(data), chunk_size):
+            reader.feed_data(data[index:index + chunk_size])
+            await asyncio.sleep(0)
+        reader.feed_eof()
+
+    async def _tally(self, questions, ballots, chunk_size):
+        readers = dict()
+        feeders = []
+        for qindex, data in ballots.items():
+            readers[qindex] = asyncio.StreamReader()
+            feeders.append(self._feed(readers[qindex], data, chunk_size))
+        results = await asyncio.gather(
+            tally_stream(questions, readers, ignore_invalid_votes=True),
+            *feeders
+        )
+        return results[0]
+
+    def _test_method(self, dirname, chunk_size):
+        results = asyncio.run(self._tally(
+            read_fixture_questions(dirname),
+            read_fixture_ballots(dirname),
+            chunk_size
+        ))
+        self.assertFixtureResults(results, dirname)
+
+    def test_stream(self):
+        self._test_method("borda", 7)
+        self._test_method("cumulative2", 1)
+        self._test_method("plurality-at-large", 4096)
+
+class TestFollowTally(FixtureMixin, unittest.TestCase):
+    def setUp(self):
+        self.tally_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        file_helpers.remove_tree(self.tally_path)
+
+    def _append(self, qindex, data):
+        question_path = os.path.join(self.tally_path, "%d-question" % qindex)
+        if not os.path.exists(question_path):
+            os.mkdir(question_path)
+        plaintexts_path = os.path.join(question_path, "plaintexts_json")
+        with open(plaintexts_path, mode='ab') as plaintexts_file:
+            plaintexts_file.write(data)
+
+    def test_poll_and_snapshot(self):
+        questions = read_fixture_questions("cumulative2")
+        ballots = read_fixture_ballots("cumulative2")
+        with TallyFollower(
+            self.tally_path,
+            questions,
+            ignore_invalid_votes=True,
+            read_buffer_size=4
+        ) as follower:
+            self.assertEqual(follower.poll(), 0)
+            for index in range(0, max(map(len, ballots.values())), 7):
+                for qindex, data in ballots.items():
+                    self._append(qindex, data[index:index + 7])
+                follower.poll()
+
+                # the snapshot is the tally of the complete lines written
+                partial_ballots = dict(
+                    (qindex, data[:index + 7].splitlines(True))
+                    for qindex, data in ballots.items()
+                )
+                for qindex, lines in list(partial_ballots.items()):
+                    if len(lines) > 0 and not lines[-1].endswith(b'\n'):
+                        lines.pop()
+                    if len(lines) == 0:
+                        del partial_ballots[qindex]
+                should_snapshot = tally_iter(
+                    questions,
+                    partial_ballots,
+                    ignore_invalid_votes=True,
+                    allow_empty_tally=True
+                )
+                self.assertEqual(follower.snapshot(), should_snapshot)
+
+            results = follower.finish()
+        self.assertFixtureResults(results, "cumulative2")
+
+    def test_follow(self):
+        questions = read_fixture_questions("borda")
+        data = bytearray(read_fixture_ballots("borda")[0])
+        snapshots = []
+
+        def stop():
+            if len(data) > 0:
+                self._append(0, data[:6])
+                del data[:6]
+                return False
+            return True
+
+        results = do_followtally(
+            self.tally_path,
+            questions,
+            snapshots.append,
+            stop,
+            snapshot_ballots=2,
+            poll_interval=0,
+            ignore_invalid_votes=True,
+            read_buffer_size=64
+        )
+        self.assertGreater(len(snapshots), 2)
+        self.assertLessEqual(
+            snapshots[0]['questions'][0]['totals']['valid_votes'],
+            snapshots[-1]['questions'][0]['totals']['valid_votes']
+        )
+        self.assertFixtureResults(results, "borda")
+
+    def test_question_indexes(self):
+        questions = read_fixture_questions("cumulative2")
+        ballots = read_fixture_ballots("cumulative2")
+        with unittest.mock.patch(
+            "tally_methods.follow.index_tally_dir",
+            wraps=index_tally_dir
+        ) as index_mock:
+            with TallyFollower(
+                self.tally_path,
+                questions,
+                ignore_invalid_votes=True,
+                question_indexes=[0]
+            ) as follower:
+                self._append(0, ballots[0])
+                self._append(1, ballots[1])
+                follower.poll()
+                follower.poll()
+                results = follower.finish()
+        # once the file of the only tallied question is open the directory is
+        # not scanned again
+        self.assertEqual(index_mock.call_count, 1)
+        self.assertEqual(
+            results['questions'][0],
+            tally_iter(
+                questions,
+                {0: ballots[0].splitlines()},
+                ignore_invalid_votes=True,
+                question_indexes=[0]
+            )['questions'][0]
+        )
+
+class TestCheckpoint(unittest.TestCase):
+
+    class Crash(Exception):
         pass
 
+    def setUp(self):
+        self.tally_path = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.tally_path, "checkpoint_json")
+
+    def tearDown(self):
+        file_helpers.remove_tree(self.tally_path)
+
+    def _create_tally(self, dirname, repetitions):
+        write_fixture_plaintexts(
+            dirname,
+            self.tally_path,
+            lambda data: data * repetitions
+        )
+        return read_fixture_questions(dirname)
+
+    def _crash_after(self, num_votes):
+        votes = [0]
+        def monkey_patcher(tally):
+            add_vote = tally.add_vote
+            def crashing_add_vote(*args, **kwargs):
+                if votes[0] == num_votes:
+                    raise self.Crash()
+                votes[0] += 1
+                add_vote(*args, **kwargs)
+            tally.add_vote = crashing_add_vote
+        return monkey_patcher
+
+    def test_resume(self):
+        for dirname in ["borda", "borda-nauru", "cumulative2"]:
+            questions = self._create_tally(dirname, 20)
+            should_results = file_helpers.serialize(do_tally(
+                self.tally_path,
+                questions,
+                ignore_invalid_votes=True
+            ))
+
+            for num_votes in [10, 50, 150]:
+                self.assertRaises(
+                    self.Crash,
+                    do_tally,
+                    self.tally_path,
+                    questions,
+                    ignore_invalid_votes=True,
+                    monkey_patcher=self._crash_after(num_votes),
+                    checkpoint_path=self.checkpoint_path,
+                    checkpoint_interval=7
+                )
+                self.assertTrue(os.path.exists(self.checkpoint_path))
+                results = do_tally(
+                    self.tally_path,
+                    questions,
+                    ignore_invalid_votes=True,
+                    checkpoint_path=self.checkpoint_path,
+                    checkpoint_interval=7
+                )
+                self.assertEqual(file_helpers.serialize(results), should_results)
+                self.assertFalse(os.path.exists(self.checkpoint_path))
+
+            for name in os.listdir(self.tally_path):
+                file_helpers.remove_tree(os.path.join(self.tally_path, name))
+
+    def test_different_election(self):
+        questions = self._create_tally("borda", 2)
+        self.assertRaises(
+            self.Crash,
+            do_tally,
+            self.tally_path,
+            questions,
+            ignore_invalid_votes=True,
+            monkey_patcher=self._crash_after(10),
+            checkpoint_path=self.checkpoint_path,
+            checkpoint_interval=3
+        )
+        self.assertRaises(
+            Exception,
+            do_tally,
+            self.tally_path,
+            questions,
+            ignore_invalid_votes=True,
+            encrypted_invalid_votes=1,
+            checkpoint_path=self.checkpoint_path
+        )
+
+    def test_question_indexes_set(self):
+        questions = self._create_tally("borda", 2)
+        should_results = file_helpers.serialize(do_tally(
+            self.tally_path,
+            questions,
+            ignore_invalid_votes=True,
+            question_indexes=[0]
+        ))
+        self.assertRaises(
+            self.Crash,
+            do_tally,
+            self.tally_path,
+            questions,
+            ignore_invalid_votes=True,
+            question_indexes=set([0]),
+            monkey_patcher=self._crash_after(10),
+            checkpoint_path=self.checkpoint_path,
+            checkpoint_interval=3
+        )
+        results = do_tally(
+            self.tally_path,
+            questions,
+            ignore_invalid_votes=True,
+            question_indexes=[0],
+            checkpoint_path=self.checkpoint_path
+        )
+        self.assertEqual(file_helpers.serialize(results), should_results)
+
+    def test_finished_question_frozen(self):
+        # the checkpoint of a finished question keeps the state it had before
+        # its post_tally, and is not rewritten while the next one is read
+        questions = self._create_tally("cumulative2", 1)
+        with TallyEngine(ignore_invalid_votes=True) as engine:
+            engine.start(questions)
+            engine.add_ballots_file(
+                0,
+                os.path.join(self.tally_path, "0-question", "plaintexts_json")
+            )
+            should_state = json.loads(json.dumps(engine.get_question_state(0)))
+
+        def monkey_patcher(tally):
+            if tally.question_num == 1:
+                self._crash_after(2)(tally)
+        self.assertRaises(
+            self.Crash,
+            do_tally,
+            self.tally_path,
+            questions,
+            ignore_invalid_votes=True,
+            monkey_patcher=monkey_patcher,
+            checkpoint_path=self.checkpoint_path,
+            checkpoint_interval=1
+        )
+        with open(self.checkpoint_path) as checkpoint_file:
+            election_digest = json.loads(
+                checkpoint_file.readline()
+            )['election_digest']
+        saved = checkpoint.read_checkpoint(self.checkpoint_path, election_digest)
+        self.assertTrue(saved['questions'][0]['finished'])
+        self.assertEqual(saved['questions'][0]['totals'], should_state['totals'])
+        self.assertEqual(saved['questions'][0]['state'], should_state['state'])
+        self.assertEqual(saved['questions'][1]['count'], 2)
+
+        # a question checkpoint whose writing was interrupted is ignored
+        with open(self.checkpoint_path, mode='a') as checkpoint_file:
+            checkpoint_file.write('{"question_index": 1, "cou')
+        results = do_tally(
+            self.tally_path,
+            questions,
+            ignore_invalid_votes=True,
+            checkpoint_path=self.checkpoint_path
+        )
+        self.assertEqual(
+            file_helpers.serialize(results),
+            file_helpers.serialize(do_tally(
+                self.tally_path,
+                questions,
+                ignore_invalid_votes=True
+            ))
+        )
+
+class TestInvalidVoteSink(FixtureMixin, unittest.TestCase):
+    def setUp(self):
+        self.sink_path = tempfile.mkstemp()[1]
+
+    def tearDown(self):
+        os.remove(self.sink_path)
+
+    def _tally(self, dirname, sink):
+        results = do_tally(
+            get_fixture_path(dirname),
+            read_fixture_questions(dirname),
+            invalid_vote_sink=sink
+        )
+        self.assertFixtureResults(results, dirname)
+
+    def test_reasons(self):
+        with FileInvalidVoteSink(self.sink_path) as sink:
+            self._tally("borda", sink)
+            self._tally("cumulative3", sink)
+        self.assertEqual(
+            sink.get_summary(),
+            dict(
+                explicit=3,
+                implicit=1,
+                decode=1,
+                framing=2,
+                written=7,
+                dropped=0
+            )
+        )
+        with open(self.sink_path, mode='rb') as sink_file:
+            lines = sink_file.read().splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[0], b'E\t0\t1\t"8"')
+        self.assertIn(b'F\t0\t1\tgarbage', lines)
+        self.assertEqual(
+            sorted(set(line.split(b'\t')[0] for line in lines)),
+            [b'D', b'E', b'F', b'I']
+        )
+
+    def test_sampling(self):
+        with FileInvalidVoteSink(self.sink_path, sample_every=2) as sink:
+            self._tally("borda", sink)
+        self.assertEqual(sink.get_summary()['written'], 4)
+        self.assertEqual(sink.get_summary()['dropped'], 1)
+
+        with FileInvalidVoteSink(self.sink_path, max_per_second=2) as sink:
+            self._tally("borda", sink)
+        self.assertEqual(sink.get_summary()['explicit'], 3)
+        self.assertLessEqual(sink.get_summary()['written'], 4)
+
+    def test_entry_points(self):
+        tally_path = get_fixture_path("cumulative2")
+        questions = read_fixture_questions("cumulative2")
+        should_sink = RecordingInvalidVoteSink()
+        do_tally(tally_path, questions, invalid_vote_sink=should_sink)
+        self.assertEqual(len(should_sink.records), 3)
+
+        temp_path = tempfile.mkdtemp()
+        try:
+            tar_path = os.path.join(temp_path, "tally.tar.gz")
+            with tarfile.open(tar_path, mode="w:gz") as tally_gz:
+                tally_gz.add(
+                    get_fixture_path("cumulative2", "questions_json"),
+                    arcname="question_json"
+                )
+                for name, plaintexts_path in iter_fixture_plaintexts(
+                    "cumulative2"
+                ):
+                    tally_gz.add(plaintexts_path, arcname=name + "/plaintexts_json")
+
+            async def tally_readers(sink):
+                readers = dict()
+                for qindex, data in read_fixture_ballots("cumulative2").items():
+                    readers[qindex] = asyncio.StreamReader()
+                    readers[qindex].feed_data(data)
+                    readers[qindex].feed_eof()
+                return await tally_stream(
+                    questions,
+                    readers,
+                    invalid_vote_sink=sink
+                )
+
+            for tally in [
+                lambda sink: do_dirtally(tally_path, invalid_vote_sink=sink),
+                lambda sink: do_tartally(tar_path, invalid_vote_sink=sink),
+                lambda sink: asyncio.run(tally_readers(sink)),
+                lambda sink: do_followtally(
+                    tally_path,
+                    questions,
+                    lambda snapshot: None,
+                    lambda: True,
+                    invalid_vote_sink=sink
+                ),
+                lambda sink: do_shardtally(
+                    tally_path,
+                    questions,
+                    os.path.join(temp_path, "shard.json"),
+                    invalid_vote_sink=sink
+                )
+            ]:
+                sink = RecordingInvalidVoteSink()
+                tally(sink)
+                self.assertEqual(sink.records, should_sink.records)
+        finally:
+            file_helpers.remove_tree(temp_path)
+
+    def test_long_int_ballot(self):
+        questions = read_fixture_questions("cumulative2")
+        # more digits than str() allows on newer interpreters
+        plaintext = 10**5000
+        with FileInvalidVoteSink(self.sink_path) as sink:
+            tally_iter(questions, {0: [plaintext], 1: []}, invalid_vote_sink=sink)
+        self.assertEqual(sink.get_summary()['decode'], 1)
+        with open(self.sink_path, mode='rb') as sink_file:
+            self.assertEqual(
+                sink_file.read(),
+                b'D\t0\t1\t1' + b'0' * 5000 + b'\n'
+            )
+
+        output = io.StringIO()
+        stdout = sys.stdout
+        sys.stdout = output
+        try:
+            tally_iter(questions, {0: [plaintext], 1: []})
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(
+            output.getvalue(),
+            "invalid vote: 1" + "0" * 5000 + "\n"
+        )
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tally_path = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        write_fixture_plaintexts("cumulative2", self.tally_path)
+        self.questions = read_fixture_questions("cumulative2")
+
+    def tearDown(self):
+        file_helpers.remove_tree(self.tally_path)
+        file_helpers.remove_tree(self.cache_dir)
+
+    def _tally(self, **kwargs):
+        tallied_questions = []
+        def monkey_patcher(tally):
+            add_vote = tally.add_vote
+            def counting_add_vote(*args, **kwargs):
+                if tally.question_num not in tallied_questions:
+                    tallied_questions.append(tally.question_num)
+                add_vote(*args, **kwargs)
+            tally.add_vote = counting_add_vote
+
+        results = do_tally(
+            self.tally_path,
+            self.questions,
+            ignore_invalid_votes=True,
+            monkey_patcher=monkey_patcher,
+            cache_dir=self.cache_dir,
+            **kwargs
+        )
+        should_results = do_tally(
+            self.tally_path,
+            self.questions,
+            ignore_invalid_votes=True,
+            **kwargs
+        )
+        self.assertEqual(
+            file_helpers.serialize(results),
+            file_helpers.serialize(should_results)
+        )
+        return tallied_questions
+
+    def test_cache(self):
+        self.assertEqual(self._tally(), [0, 1])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        self.assertEqual(self._tally(), [])
+
+        # only the modified questions are tallied again
+        with open(
+            os.path.join(self.tally_path, "1-question", "plaintexts_json"),
+            mode='ab'
+        ) as plaintexts_file:
+            plaintexts_file.write(b'"7"\n')
+        self.assertEqual(self._tally(), [1])
+        self.assertEqual(self._tally(), [])
+
+        withdrawals = [dict(question_index=0, answer_id=1)]
+        self.assertEqual(self._tally(withdrawals=withdrawals), [0])
+        self.assertEqual(self._tally(withdrawals=withdrawals), [])
+        self.assertEqual(self._tally(question_indexes=[1]), [])
+        self.assertEqual(self._tally(encrypted_invalid_votes=2), [0, 1])
+
+    def test_invalid_vote_sink(self):
+        should_sink = RecordingInvalidVoteSink()
+        do_tally(
+            self.tally_path,
+            self.questions,
+            invalid_vote_sink=should_sink
+        )
+        self.assertGreater(len(should_sink.records), 0)
+
+        # the invalid ballots are cached even without a sink, and reported
+        # again on each cache hit
+        do_tally(
+            self.tally_path,
+            self.questions,
+            ignore_invalid_votes=True,
+            cache_dir=self.cache_dir
+        )
+        for jobs in [1, 2, 1]:
+            sink = RecordingInvalidVoteSink()
+            do_tally(
+                self.tally_path,
+                self.questions,
+                invalid_vote_sink=sink,
+                cache_dir=self.cache_dir,
+                jobs=jobs
+            )
+            self.assertEqual(sink.records, should_sink.records)
+
+        file_helpers.remove_tree(self.cache_dir)
+        sink = RecordingInvalidVoteSink()
+        do_tally(
+            self.tally_path,
+            self.questions,
+            ignore_invalid_votes=True,
+            cache_dir=self.cache_dir,
+            jobs=2
+        )
+        do_tally(
+            self.tally_path,
+            self.questions,
+            invalid_vote_sink=sink,
+            cache_dir=self.cache_dir
+        )
+        self.assertEqual(sink.records, should_sink.records)
+
+class TestCompressedPlaintexts(FixtureMixin, unittest.TestCase):
+    def setUp(self):
+        self.tally_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        file_helpers.remove_tree(self.tally_path)
+
+    def _test_method(self, dirname, extension, compress):
+        write_fixture_plaintexts(
+            dirname,
+            self.tally_path,
+            compress,
+            "plaintexts_json" + extension
+        )
+        results = do_tally(
+            self.tally_path,
+            read_fixture_questions(dirname),
+            ignore_invalid_votes=True
+        )
+        self.assertFixtureResults(results, dirname)
+
+    def test_gzip(self):
+        self._test_method("cumulative2", ".gz", gzip.compress)
+
+    def test_bz2(self):
+        self._test_method("borda", ".bz2", bz2.compress)
+
+    def test_xz(self):
+        self._test_method("plurality-at-large", ".xz", lzma.compress)
+
+class TestBallotFile(FixtureMixin, unittest.TestCase):
+    def setUp(self):
+        self.tally_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        file_helpers.remove_tree(self.tally_path)
+
+    def test_convert(self):
+        os.mkdir(os.path.join(self.tally_path, "0-question"))
+        src_path = get_fixture_path("borda", "0-question", "plaintexts_json")
+        dst_path = os.path.join(
+            self.tally_path, "0-question", BALLOT_FILE_NAME
+        )
+        count = ballot_file.convert_plaintexts(src_path, dst_path)
+        self.assertLess(os.path.getsize(dst_path), os.path.getsize(src_path))
+
+        with open(src_path, mode='rb') as plaintexts_file:
+            lines = plaintexts_file.readlines()
+        self.assertEqual(count, len(lines))
+        with ballot_file.BallotFileReader(dst_path) as reader:
+            self.assertEqual(reader.question_id, "0-question")
+            plaintexts = list(reader)
+        self.assertEqual(plaintexts[:-1], [int(line[1:-2]) for line in lines[:-1]])
+        # the last line of the fixture is garbage
+        self.assertIsNone(plaintexts[-1])
+
+        results = do_tally(
+            self.tally_path,
+            read_fixture_questions("borda"),
+            ignore_invalid_votes=True
+        )
+        self.assertFixtureResults(results, "borda")
+
+    def test_truncated(self):
+        path = os.path.join(self.tally_path, BALLOT_FILE_NAME)
+        with open(path, mode='wb') as binary_file:
+            ballot_file.write_header(binary_file, "0-question")
+            binary_file.write(ballot_file.encode_record(2 ** 70))
+            binary_file.write(ballot_file.encode_record(None))
+            binary_file.write(ballot_file.encode_record(300)[:-1])
+        with ballot_file.BallotFileReader(path) as reader:
+            self.assertEqual(list(reader), [2 ** 70, None, None])
+
+    def test_close_while_iterating(self):
+        path = os.path.join(self.tally_path, BALLOT_FILE_NAME)
+        plaintexts = list(range(1000))
+        with open(path, mode='wb') as binary_file:
+            ballot_file.write_header(binary_file, "0-question")
+            for plaintext in plaintexts:
+                binary_file.write(ballot_file.encode_record(plaintext))
+        with ballot_file.BallotFileReader(path) as reader:
+            self.assertEqual(list(reader), plaintexts)
+
+        # the reader can be closed while iterating it, and tell() gives the
+        # position after the last plaintext yielded
+        reader = ballot_file.BallotFileReader(path)
+        records = iter(reader)
+        next(records)
+        self.assertEqual(reader.tell(), reader.data_start + 1)
+        reader.close()
+
+class TestTarTally(FixtureMixin, unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        file_helpers.remove_tree(self.temp_path)
+
+    def _create_tar(self, dirname, questions_first, fixture_path=None):
+        if fixture_path is None:
+            fixture_path = get_fixture_path(dirname)
+        tar_path = os.path.join(self.temp_path, dirname + ".tar.gz")
+        with tarfile.open(tar_path, mode="w:gz") as tally_gz:
+            if questions_first:
+                tally_gz.add(
+                    os.path.join(fixture_path, "questions_json"),
+                    arcname="question_json"
+                )
+            for name in sorted(os.listdir(fixture_path)):
+                plaintexts_path = os.path.join(
+                    fixture_path, name, "plaintexts_json"
+                )
+                if os.path.exists(plaintexts_path):
+                    tally_gz.add(
+                        plaintexts_path,
+                        arcname=name + "/plaintexts_json"
+                    )
+            if not questions_first:
+                tally_gz.add(
+                    os.path.join(fixture_path, "questions_json"),
+                    arcname="question_json"
+                )
+        return tar_path
+
+    def _test_method(self, dirname, questions_first):
+        tar_path = self._create_tar(dirname, questions_first)
+        results = do_tartally(tar_path, ignore_invalid_votes=True)
+        self.assertFixtureResults(results, dirname)
+
+    def test_stream(self):
+        self._test_method("cumulative2", questions_first=True)
+        self._test_method("borda", questions_first=True)
+
+    def test_questions_last(self):
+        self._test_method("cumulative2", questions_first=False)
+
+    def test_index(self):
+        tar_path = self._create_tar("cumulative2", questions_first=False)
+        indexed_path = os.path.join(self.temp_path, "indexed.tar.gz")
+        index = tar_index.write_indexed_tar(
+            tar_path,
+            indexed_path,
+            checkpoint_interval=512
+        )
+        self.assertGreater(len(index['checkpoints']), 3)
+
+        # the indexed tar is a normal tar.gz with the same members
+        with tarfile.open(tar_path, mode="r:gz") as tally_gz:
+            for member in tally_gz.getmembers():
+                with tar_index.open_member(
+                    indexed_path, index, member.name
+                ) as member_file:
+                    self.assertEqual(
+                        member_file.read(),
+                        tally_gz.extractfile(member).read()
+                    )
+
+        index_path = os.path.join(self.temp_path, "index_json")
+        for path in [tar_path, indexed_path]:
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            results = do_tartally(
+                path,
+                ignore_invalid_votes=True,
+                index_path=index_path
+            )
+            self.assertTrue(os.path.exists(index_path))
+            self.assertEqual(
+                results,
+                do_tartally(tar_path, ignore_invalid_votes=True)
+            )
+
+        # tally only one question using the index
+        results = do_tartally(
+            indexed_path,
+            question_indexes=[1],
+            index_path=index_path
+        )
+        should_results = do_tartally(tar_path, question_indexes=[1])
+        self.assertEqual(results, should_results)
+
+    def test_regenerated_archive(self):
+        # the first version of the archive only has some of the ballots
+        partial_path = os.path.join(self.temp_path, "partial")
+        shutil.copytree(get_fixture_path("cumulative2"), partial_path)
+        for qindex, (_, path) in index_tally_dir(partial_path).items():
+            with open(path, mode='rb') as plaintexts_file:
+                lines = plaintexts_file.readlines()
+            with open(path, mode='wb') as plaintexts_file:
+                plaintexts_file.writelines(lines[:len(lines) // 3])
+
+        index_path = os.path.join(self.temp_path, "index_json")
+        tar_path = self._create_tar(
+            "cumulative2",
+            questions_first=True,
+            fixture_path=partial_path
+        )
+        partial_results = do_tartally(
+            tar_path,
+            ignore_invalid_votes=True,
+            index_path=index_path
+        )
+        tar_path = self._create_tar("cumulative2", questions_first=True)
+        with self.assertRaises(Exception):
+            tar_index.read_index(index_path, tar_path)
+
+        # the index is rebuilt for the regenerated archive
+        results = do_tartally(
+            tar_path,
+            ignore_invalid_votes=True,
+            index_path=index_path
+        )
+        self.assertNotEqual(results, partial_results)
+        self.assertFixtureResults(results, "cumulative2")
+        self.assertEqual(
+            tar_index.read_index(index_path, tar_path)['archive'],
+            tar_index.get_archive_info(tar_path)
+        )
+
+    def _count_decompressed(self, function, *args, **kwargs):
+        '''
+        Calls function and returns a pair with its result and the number of
+        bytes decompressed by the tar index meanwhile
+        '''
+        decompressed = [0]
+        read_chunk = tar_index._GzipMembersReader._read_chunk
+        def counting_read_chunk(reader):
+            chunk = read_chunk(reader)
+            decompressed[0] += len(chunk)
+            return chunk
+        with unittest.mock.patch.object(
+            tar_index._GzipMembersReader,
+            "_read_chunk",
+            counting_read_chunk
+        ):
+            result = function(*args, **kwargs)
+        return (result, decompressed[0])
+
+    def test_index_single_pass(self):
+        # random plaintexts hardly compress, so that each chunk read from the
+        # archive is small compared with the archive
+        large_path = os.path.join(self.temp_path, "large")
+        os.mkdir(large_path)
+        write_fixture_plaintexts("cumulative2", large_path)
+        shutil.copy(get_fixture_path("cumulative2", "questions_json"), large_path)
+        rand = random.Random(0)
+        with open(
+            os.path.join(large_path, "0-question", "plaintexts_json"),
+            mode='a'
+        ) as plaintexts_file:
+            for _ in range(50000):
+                plaintexts_file.write('"%d"\n' % rand.randrange(10 ** 9))
+        tar_path = self._create_tar(
+            "cumulative2",
+            questions_first=True,
+            fixture_path=large_path
+        )
+        with open(tar_path, mode='rb') as tar_file:
+            tar_size = len(gzip.decompress(tar_file.read()))
+        should_results = do_tartally(tar_path, ignore_invalid_votes=True)
+
+        # with a single checkpoint, the members are read in one pass instead
+        # of decompressing the archive from the start for each one
+        index_path = os.path.join(self.temp_path, "index_json")
+        index = tar_index.get_index(tar_path, index_path)
+        self.assertEqual(len(index['checkpoints']), 1)
+        results, decompressed = self._count_decompressed(
+            do_tartally,
+            tar_path,
+            ignore_invalid_votes=True,
+            index_path=index_path
+        )
+        self.assertEqual(results, should_results)
+        self.assertLess(decompressed, 1.5 * tar_size)
+
+        # with several checkpoints, only the members of the tallied questions
+        # are decompressed
+        indexed_path = os.path.join(self.temp_path, "indexed.tar.gz")
+        tar_index.write_indexed_tar(tar_path, indexed_path, 4096)
+        os.remove(index_path)
+        tar_index.get_index(indexed_path, index_path, 4096)
+        results, decompressed = self._count_decompressed(
+            do_tartally,
+            indexed_path,
+            ignore_invalid_votes=True,
+            question_indexes=[1],
+            index_path=index_path
+        )
+        self.assertEqual(
+            results,
+            do_tartally(tar_path, ignore_invalid_votes=True, question_indexes=[1])
+        )
+        self.assertLess(decompressed, tar_size / 10)
+
+class TestZipTally(FixtureMixin, unittest.TestCase):
+    def setUp(self):
+        self.zip_path = tempfile.mkstemp(suffix=".zip")[1]
+
+    def tearDown(self):
+        os.remove(self.zip_path)
+
+    def _test_method(self, dirname, workers):
+        with zipfile.ZipFile(
+            self.zip_path,
+            mode='w',
+            compression=zipfile.ZIP_DEFLATED
+        ) as tally_zip:
+            # the plaintexts go first, in reverse order
+            for name, plaintexts_path in reversed(
+                list(iter_fixture_plaintexts(dirname))
+            ):
+                tally_zip.write(plaintexts_path, name + "/plaintexts_json")
+            tally_zip.write(
+                get_fixture_path(dirname, "questions_json"),
+                "questions_json"
+            )
+
+        results = do_ziptally(
+            self.zip_path,
+            ignore_invalid_votes=True,
+            workers=workers
+        )
+        self.assertFixtureResults(results, dirname)
+
+    def test_workers(self):
+        self._test_method("cumulative2", 2)
+        self._test_method("borda-nauru", 2)
+
+    def test_single_worker(self):
+        self._test_method("cumulative2", 1)
+
+class TestParallelDirTally(FixtureMixin, unittest.TestCase):
+    def test_jobs(self):
+        for dirname in ["cumulative2", "borda-nauru"]:
+            results = do_dirtally(get_fixture_path(dirname), jobs=2)
+            self.assertFixtureResults(results, dirname)
+
+    def test_jobs_invalid_vote_sink(self):
+        tally_path = get_fixture_path("cumulative2")
+        questions = read_fixture_questions("cumulative2")
+        should_sink = RecordingInvalidVoteSink()
+        do_tally(tally_path, questions, invalid_vote_sink=should_sink)
+        self.assertEqual(len(should_sink.records), 3)
+
+        sink = RecordingInvalidVoteSink()
+        do_tally(tally_path, questions, invalid_vote_sink=sink, jobs=2)
+        self.assertEqual(sink.records, should_sink.records)
+        self.assertEqual(sink.get_summary(), should_sink.get_summary())
+
+        sink = RecordingInvalidVoteSink()
+        do_chunkedtally(
+            tally_path,
+            questions,
+            invalid_vote_sink=sink,
+            workers=2,
+            min_chunk_size=1
+        )
+        self.assertEqual(sink.records, should_sink.records)
+
+    def test_jobs_with_tallies(self):
+        tally_path = get_fixture_path("cumulative2")
+        questions = read_fixture_questions("cumulative2")
+        with self.assertRaises(ValueError):
+            do_tally(tally_path, questions, tallies=[], jobs=2)
+
+    def test_jobs_with_cache(self):
+        tally_path = get_fixture_path("cumulative2")
+        questions = read_fixture_questions("cumulative2")
+        cache_dir = tempfile.mkdtemp()
+        try:
+            should_results = do_tally(tally_path, copy.deepcopy(questions))
+            for _ in range(2):
+                results = do_tally(
+                    tally_path,
+                    copy.deepcopy(questions),
+                    cache_dir=cache_dir,
+                    jobs=2
+                )
+                self.assertEqual(
+                    file_helpers.serialize(results),
+                    file_helpers.serialize(should_results)
+                )
+        finally:
+            file_helpers.remove_tree(cache_dir)
+
+class TestChunkedTally(FixtureMixin, unittest.TestCase):
+    def _assert_same_as_sequential(self, tally_path):
+        questions = json.loads(file_helpers.read_file(
+            os.path.join(tally_path, "questions_json")
+        ))
+        should_results = do_tally(
+            tally_path,
+            copy.deepcopy(questions),
+            ignore_invalid_votes=True
+        )
+        # chunks of a single byte split the files in as many chunks as workers
+        for use_shared_memory, use_threads in [
+            (False, False),
+            (True, False),
+            (False, True)
+        ]:
+            results = do_chunkedtally(
+                tally_path,
+                copy.deepcopy(questions),
+                ignore_invalid_votes=True,
+                workers=3,
+                min_chunk_size=1,
+                use_shared_memory=use_shared_memory,
+                use_threads=use_threads
+            )
+            self.assertEqual(
+                file_helpers.serialize(results),
+                file_helpers.serialize(should_results)
+            )
+
+    def test_fixtures(self):
+        for dirname in sorted(os.listdir(FIXTURES_PATH)):
+            self._assert_same_as_sequential(get_fixture_path(dirname))
+
+    def test_threads(self):
+        # tallied by threads or, with the global interpreter lock, sequentially
+        results = do_tally(
+            get_fixture_path("cumulative2"),
+            read_fixture_questions("cumulative2"),
+            threads=4
+        )
+        self.assertFixtureResults(results, "cumulative2")
+
+    def test_desborda(self):
+        for data, tally_type in [
+            (test.desborda_test_data.test_desborda_1, "desborda"),
+            (test.desborda_test_data.test_desborda2_1, "desborda2")
+        ]:
+            tally_path = test.desborda_test.create_desborda_test(
+                data,
+                tally_type=tally_type
+            )
+            try:
+                self._assert_same_as_sequential(tally_path)
+            finally:
+                file_helpers.remove_tree(tally_path)
+
+    def test_merge_question_state(self):
+        questions = read_fixture_questions("borda")
+        lines = read_fixture_ballots("borda")[0].decode('utf-8').splitlines()
+        should_results = tally_iter(
+            copy.deepcopy(questions),
+            {0: lines},
+            ignore_invalid_votes=True,
+            encrypted_invalid_votes=3
+        )
+
+        with TallyEngine(ignore_invalid_votes=True) as engine, \
+                TallyEngine(ignore_invalid_votes=True) as chunk_engine:
+            engine.start(questions, encrypted_invalid_votes=3)
+            engine.add_ballots(0, lines[:len(lines) // 2], parse_plaintext)
+            chunk_engine.start(questions)
+            chunk_engine.add_ballots(0, lines[len(lines) // 2:], parse_plaintext)
+            engine.merge_question_state(
+                0,
+                chunk_engine.get_question_state(0)
+            )
+            results = engine.finish()
+        self.assertEqual(
+            file_helpers.serialize(results),
+            file_helpers.serialize(should_results)
+        )
+
+class TestShardTally(FixtureMixin, unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        file_helpers.remove_tree(self.tmp_path)
+
+    def _write_shards(self, dirname, num_shards):
+        '''
+        Splits the ballots of the given fixture in num_shards tally
+        directories, with the ballots of each question dealt round robin
+        '''
+        shard_dirs = []
+        for shard_index in range(num_shards):
+            shard_dir = os.path.join(self.tmp_path, "shard%d" % shard_index)
+            os.mkdir(shard_dir)
+            shutil.copy(get_fixture_path(dirname, "questions_json"), shard_dir)
+            shard_dirs.append(shard_dir)
+
+        for question_id, path in iter_fixture_plaintexts(dirname):
+            with open(path, mode='rb') as plaintexts_file:
+                lines = plaintexts_file.readlines()
+            for shard_index, shard_dir in enumerate(shard_dirs):
+                os.mkdir(os.path.join(shard_dir, question_id))
+                with open(
+                    os.path.join(shard_dir, question_id, "plaintexts_json"),
+                    mode='wb'
+                ) as plaintexts_file:
+                    plaintexts_file.writelines(lines[shard_index::num_shards])
+        return shard_dirs
+
+    def test_subprocesses(self):
+        for dirname in ["cumulative2", "borda", "plurality-at-large"]:
+            shard_dirs = self._write_shards(dirname, 3)
+            shard_paths = []
+            for shard_dir in shard_dirs:
+                shard_path = shard_dir + ".json"
+                subprocess.run(
+                    [
+                        sys.executable, "-m", "tally_methods.shard",
+                        "shard", shard_dir, shard_path
+                    ],
+                    check=True,
+                    stdout=subprocess.DEVNULL
+                )
+                shard_paths.append(shard_path)
+
+            results = do_mergetally(
+                shard_paths,
+                read_fixture_questions(dirname)
+            )
+            self.assertFixtureResults(results, dirname)
+            file_helpers.remove_tree(self.tmp_path)
+            os.mkdir(self.tmp_path)
+
+    def test_different_election(self):
+        shard_dirs = self._write_shards("cumulative2", 1)
+        questions = read_fixture_questions("cumulative2")
+        shard_path = os.path.join(self.tmp_path, "shard.json")
+        do_shardtally(
+            shard_dirs[0],
+            questions,
+            shard_path,
+            ignore_invalid_votes=True
+        )
+        questions[0]['max'] += 1
+        with self.assertRaises(Exception):
+            do_mergetally([shard_path], questions)
+
+class TestLongBallots(unittest.TestCase):
+    def _to_decimal(self, value):
+        # str() of very long ints is limited too in newer interpreters
+        if hasattr(sys, 'set_int_max_str_digits'):
+            max_str_digits = sys.get_int_max_str_digits()
+            sys.set_int_max_str_digits(0)
+            try:
+                return str(value)
+            finally:
+                sys.set_int_max_str_digits(max_str_digits)
+        return str(value)
+
+    def test_long_write_in(self):
+        question = dict(
+            tally_type="plurality-at-large",
+            answer_total_votes_percentage="over-total-valid-votes",
+            max=1,
+            min=0,
+            num_winners=1,
+            title="Write-ins question",
+            extra_options=dict(allow_writeins=True),
+            answers=[
+                dict(id=0, text="Alice", category="", details="", urls=[]),
+                dict(
+                    id=1,
+                    text="",
+                    category="",
+                    details="",
+                    urls=[dict(title='isWriteIn', url='true')]
+                )
+            ]
+        )
+        ballot_question = copy.deepcopy(question)
+        ballot_question['answers'][0]['selected'] = -1
+        ballot_question['answers'][1]['selected'] = 0
+        ballot_question['answers'][1]['text'] = "Bob" * 1000
+        codec = NVotesCodec(ballot_question)
+        int_ballot = codec.encode_to_int(codec.encode_raw_ballot())
+        plaintext = '"' + self._to_decimal(int_ballot + 1) + '"\n'
+        self.assertGreater(len(plaintext), 5000)
+
+        results = tally_iter([question], {0: [plaintext], 1: []})
+        result_question = results['questions'][0]
+        self.assertEqual(result_question['totals']['valid_votes'], 1)
+        self.assertEqual(result_question['totals']['null_votes'], 0)
+        self.assertEqual(result_question['answers'][1]['text'], "Bob" * 1000)
+
+class TestVoteRecord(unittest.TestCase):
+    def _add_votes(self, make_vote):
+        questions = read_fixture_questions("borda")
+        question = questions[0]
+        question['totals'] = dict(blank_votes=0, null_votes=0, valid_votes=0)
+        tally = Borda.create_tally(question=question, question_num=0)
+        tally.pre_tally(questions)
+        for int_ballot in [14, 42, 6]:
+            choices = tally.parse_vote(int_ballot, question)
+            tally.add_vote(
+                voter_answers=make_vote(choices),
+                questions=questions,
+                is_delegated=False
+            )
+        tally.post_tally(questions)
+        return questions
+
+    def test_legacy_voter_answers(self):
+        results = self._add_votes(lambda choices: VoteRecord(choices=choices))
+        legacy_results = self._add_votes(
+            lambda choices: [dict(choices=choices, is_blank=False, is_null=False)]
+        )
+        self.assertEqual(results, legacy_results)
+
+class TestDesborda(unittest.TestCase):
     def test_borda(self):
         # from the variables passed as arguments, create a folder with the data
         # in a format usable for tests
@@ -179,12 +1752,6 @@ class TestDesborda(unittest.TestCase):
             raise
 
 class TestDesborda2(unittest.TestCase):
-
-    def setUp(self):
-        # http://effbot.org/zone/default-values.htm
-        six.get_function_defaults(do_tally)[0][:] = []
-        pass
-
     def _do_test(self, data = None):
         if not data:
             return